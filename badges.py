@@ -0,0 +1,155 @@
+"""Badge definitions and rules for the Finasaur app.
+
+Every badge is a threshold on one counter ("counter >= threshold"). The
+rules are indexed by counter, so when one counter changes only the badges
+that depend on it are looked at, with a bisect over their thresholds.
+
+When a badge is added or a threshold changes, run this module to award
+newly earned badges to every stored profile in bulk:
+
+    python badges.py [--db finasaur.db] [--chunk-size 50000]
+
+It does not need Streamlit. Stop the app first, since live sessions save
+the badges they have in memory over the backfilled ones.
+"""
+import argparse
+import bisect
+import os
+import time
+from typing import Dict, Iterable, List
+
+from lazy_imports import LazyModule
+
+np = LazyModule("numpy")
+
+BACKFILL_CHUNK_SIZE = 50000
+
+# Counters badge rules can depend on
+COMPLETED_LESSONS = "completed_lessons"
+PERFECT_LESSONS = "perfect_lessons"
+CORRECT_ANSWERS = "correct_answers"
+STREAK = "streak"
+COINS = "coins"
+XP = "xp"
+COUNTERS = (COMPLETED_LESSONS, PERFECT_LESSONS, CORRECT_ANSWERS, STREAK, COINS, XP)
+
+COUNTER_LABELS = {
+    COMPLETED_LESSONS: "lessons completed",
+    PERFECT_LESSONS: "perfect lessons",
+    CORRECT_ANSWERS: "correct answers",
+    STREAK: "day streak",
+    COINS: "coins",
+    XP: "XP",
+}
+
+BADGES = {
+    "First Steps": {"requirement": "Complete your first lesson", "icon": "🎯",
+                    "counter": COMPLETED_LESSONS, "threshold": 1},
+    "Question Master": {"requirement": "Answer 10 questions correctly", "icon": "🧠",
+                        "counter": CORRECT_ANSWERS, "threshold": 10},
+    "Streak Champion": {"requirement": "Maintain a 7-day streak", "icon": "🔥",
+                        "counter": STREAK, "threshold": 7},
+    "Saver": {"requirement": "Earn 500 coins", "icon": "💰",
+              "counter": COINS, "threshold": 500},
+    "Dedicated Learner": {"requirement": "Complete 5 lessons", "icon": "📚",
+                          "counter": COMPLETED_LESSONS, "threshold": 5},
+    "Perfect Score": {"requirement": "Get 100% on a lesson", "icon": "⭐",
+                      "counter": PERFECT_LESSONS, "threshold": 1},
+    "Century Club": {"requirement": "Answer 100 questions correctly", "icon": "🏆",
+                     "counter": CORRECT_ANSWERS, "threshold": 100},
+}
+
+
+def _index_rules():
+    thresholds: Dict[str, List[int]] = {}
+    names: Dict[str, List[str]] = {}
+    rules = sorted((badge['counter'], badge['threshold'], name) for name, badge in BADGES.items())
+    for counter, threshold, name in rules:
+        thresholds.setdefault(counter, []).append(threshold)
+        names.setdefault(counter, []).append(name)
+    return thresholds, names
+
+
+# counter -> ascending thresholds, and the badge names in the same order
+RULE_THRESHOLDS, RULE_BADGES = _index_rules()
+
+
+def newly_earned(counter, value, earned) -> List[str]:
+    """Badges that counter reaching value unlocks and that are not in earned yet"""
+    thresholds = RULE_THRESHOLDS.get(counter)
+    if not thresholds:
+        return []
+    reached = bisect.bisect_right(thresholds, value)
+    return [name for name in RULE_BADGES[counter][:reached] if name not in earned]
+
+
+def progress_label(name, value):
+    """How far value is towards a badge, e.g. '7/10 correct answers'"""
+    badge = BADGES[name]
+    return f"{min(value, badge['threshold'])}/{badge['threshold']} {COUNTER_LABELS[badge['counter']]}"
+
+
+def in_display_order(earned: Iterable[str]) -> List[str]:
+    """Earned badges in the order BADGES lists them"""
+    earned = set(earned)
+    return [name for name in BADGES if name in earned]
+
+
+def backfill_chunk(chunk):
+    """(username, all badges) for every profile in a column chunk that earns a new badge
+
+    Each rule is one vectorized comparison over the whole chunk.
+    """
+    names = list(BADGES)
+    count = len(chunk["username"])
+    held = np.array([[name in earned for name in names] for earned in map(set, chunk["badges"])],
+                    dtype=bool).reshape(count, len(names))
+    reached = np.column_stack([
+        np.asarray(chunk[badge['counter']], dtype=np.int64) >= badge['threshold']
+        for badge in BADGES.values()
+    ])
+    new = reached & ~held
+    updates = []
+    for row in np.flatnonzero(new.any(axis=1)).tolist():
+        earned = chunk["badges"][row] + [name for name, is_new in zip(names, new[row]) if is_new]
+        updates.append((chunk["username"][row], in_display_order(earned)))
+    return updates
+
+
+def backfill(store, chunk_size=BACKFILL_CHUNK_SIZE, journal_path=None):
+    """Award every stored profile the badges the current rules say it has earned
+
+    Saves still waiting in the app's journal are applied first, so they
+    cannot later overwrite the backfilled badges. Returns how many profiles
+    gained a badge.
+    """
+    from journal import DEFAULT_JOURNAL_PATH, replay_pending
+
+    replay_pending(journal_path or DEFAULT_JOURNAL_PATH, store.apply_events)
+    updated = 0
+    for chunk in store.badge_counter_chunks(chunk_size):
+        updates = backfill_chunk(chunk)
+        if updates:
+            store.save_badges(updates)
+            updated += len(updates)
+    return updated
+
+
+def main():
+    from storage import DEFAULT_DB_PATH, ProfileStore
+
+    parser = argparse.ArgumentParser(description="Award newly earned badges to every stored profile")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="profile database (default: %(default)s)")
+    parser.add_argument("--chunk-size", type=int, default=BACKFILL_CHUNK_SIZE, help="profiles per chunk")
+    args = parser.parse_args()
+    if not os.path.exists(args.db):
+        parser.error(f"no database at {args.db}")
+    start = time.perf_counter()
+    store = ProfileStore(args.db)
+    updated = backfill(store, args.chunk_size)
+    store.close()
+    print(f"Backfilled badges for {updated} profiles in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
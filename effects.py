@@ -0,0 +1,87 @@
+"""Timed shop effects for the Finasaur app.
+
+Buying a time-bound item (like the XP Booster) starts an effect that ends
+at a fixed time. Active effects sit in a per-user dict, so asking for a
+user's XP multiplier is a dict lookup, and their end times sit in one
+min-heap shared by every user. Effects are expired lazily: each call first
+pops whatever is due off the top of the heap, so no call ever scans all
+users and the cost of expiring an effect is paid once.
+"""
+import heapq
+import threading
+import time
+from typing import Dict, List
+
+XP_BOOSTER = "XP Booster"
+
+# Shop items that start an effect: name -> multipliers it applies and for how long
+EFFECTS = {
+    XP_BOOSTER: {"xp_multiplier": 2, "duration": 24 * 3600},
+}
+
+
+class EffectScheduler:
+    """Active timed effects per username, expired off a min-heap of end times"""
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._active: Dict[str, Dict[str, float]] = {}  # username -> effect -> ends at
+        self._heap: List[tuple] = []  # (ends at, username, effect)
+
+    def _expire(self, now):
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            ends_at, username, effect = heapq.heappop(heap)
+            effects = self._active.get(username)
+            # A renewed effect leaves its old end time behind in the heap
+            if effects is not None and effects.get(effect) == ends_at:
+                del effects[effect]
+                if not effects:
+                    del self._active[username]
+
+    def _start(self, username, effect, ends_at):
+        self._active.setdefault(username, {})[effect] = ends_at
+        heapq.heappush(self._heap, (ends_at, username, effect))
+
+    def activate(self, username, effect) -> float:
+        """Start effect for username, or extend it if it is running; returns when it ends"""
+        with self._lock:
+            now = self.clock()
+            self._expire(now)
+            ends_at = max(now, self._active.get(username, {}).get(effect, now)) + EFFECTS[effect]["duration"]
+            self._start(username, effect, ends_at)
+            return ends_at
+
+    def restore(self, username, effects):
+        """Pick up effects saved with a profile, as {effect: ends at}"""
+        with self._lock:
+            now = self.clock()
+            self._expire(now)
+            current = self._active.get(username, {})
+            for effect, ends_at in effects.items():
+                if effect in EFFECTS and ends_at > max(now, current.get(effect, 0)):
+                    self._start(username, effect, ends_at)
+
+    def active(self, username) -> Dict[str, float]:
+        """username's running effects as {effect: ends at}"""
+        with self._lock:
+            self._expire(self.clock())
+            return dict(self._active.get(username, {}))
+
+    def xp_multiplier(self, username) -> int:
+        with self._lock:
+            self._expire(self.clock())
+            effects = self._active.get(username)
+            if not effects:
+                return 1
+            multiplier = 1
+            for effect in effects:
+                multiplier *= EFFECTS[effect].get("xp_multiplier", 1)
+            return multiplier
+
+    def rename(self, old_username, new_username):
+        with self._lock:
+            effects = self._active.pop(old_username, None)
+        if effects:
+            self.restore(new_username, effects)
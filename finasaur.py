@@ -1,11 +1,44 @@
+from lazy_imports import LazyModule, import_timings, record_import
+
 import streamlit as st
+# streamlit is already loaded by `streamlit run` before this script starts, so
+# only the app's own modules are timed; each first import runs on the first
+# script run in the server process
+with record_import("badges"):
+    import badges
+    from badges import BADGES
+with record_import("effects"):
+    from effects import EFFECTS, EffectScheduler
+with record_import("friends"):
+    from friends import ACCEPTED, ALREADY_FRIENDS, ALREADY_SENT, ActivityFeed, FriendGraph, FriendRankings
+with record_import("journal"):
+    from journal import DEFAULT_JOURNAL_PATH, EventJournal, answer_event, friend_event, profile_event, xp_event
+with record_import("leaderboard"):
+    from leaderboard import WINDOWS, Leaderboard, SnapshotPublisher, WindowedLeaderboards, earliest_period_start
+with record_import("levels"):
+    from levels import load_curve
+with record_import("storage"):
+    from storage import ProfileStore
+with record_import("sessions"):
+    from sessions import OpenProfiles, UserData
+with record_import("streaks"):
+    from streaks import ActivityCalendar
+with record_import("suggestions"):
+    from suggestions import FriendSuggestions
+with record_import("usernames"):
+    from usernames import UsernameIndex
 import json
 import datetime
+import hashlib
+import re
 import random
+import time
+import uuid
 from typing import Dict, List, Optional
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
+
+# Heavy libraries are only imported the first time a page uses them
+pd = LazyModule("pandas")
+LAZY_MODULES = {"pandas": pd}
 
 # Page configuration
 st.set_page_config(
@@ -16,496 +49,495 @@ st.set_page_config(
 )
 
 # --- THEME CSS ---
-def inject_theme_css(night_mode=False):
-    if not night_mode:
-        # White & light green theme
-        st.markdown("""
-        <style>
-        .stApp, .block-container {
-            background-color: #fff !important;
-        }
-        body {
-            background-color: #fff !important;
-            color: #222 !important;
-        }
-        .main-header {
-            font-size: 2.5rem;
-            font-weight: bold;
-            color: #43b77a;
-            text-align: center;
-            margin-bottom: 1.5rem;
-            letter-spacing: 1px;
-        }
-        .duo-mascot {
-            font-size: 2.5rem;
-            margin-right: 0.5rem;
-            vertical-align: middle;
-        }
-        .lesson-card {
-            background: #f6fcf7 !important;
-            padding: 1.5rem;
-            border-radius: 18px;
-            margin: 1.2rem 0;
-            border-left: 8px solid #43b77a;
-            box-shadow: 0 2px 8px rgba(67,183,122,0.08);
-            transition: box-shadow 0.2s;
-        }
-        .lesson-card:hover {
-            box-shadow: 0 4px 16px rgba(67,183,122,0.18);
-        }
-        .question-card {
-            background: #fff !important;
-            padding: 2rem;
-            border-radius: 18px;
-            margin: 1.5rem 0;
-            box-shadow: 0 2px 8px rgba(67,183,122,0.08);
-            border: 2px solid #43b77a;
-        }
-        .badge {
-            display: inline-block;
-            background-color: #e6f9ed;
-            color: #43b77a;
-            padding: 0.5rem 1rem;
-            border-radius: 20px;
-            margin: 0.25rem;
-            font-weight: bold;
-        }
-        .streak-counter {
-            background: linear-gradient(45deg, #ffb36b, #ffe066);
-            color: #fff;
-            padding: 1rem;
-            border-radius: 10px;
-            text-align: center;
-            margin: 1rem 0;
-        }
-        .duo-btn {
-            background-color: #43b77a !important;
-            color: #fff !important;
-            border-radius: 12px !important;
-            font-size: 1.1rem !important;
-            font-weight: bold !important;
-            padding: 0.7rem 2.2rem !important;
-            margin: 0.5rem 0 !important;
-            border: none !important;
-            box-shadow: 0 2px 8px rgba(67,183,122,0.08);
-            transition: background 0.2s;
-        }
-        .duo-btn:hover {
-            background-color: #2e8c5e !important;
-        }
-        .duo-progress {
-            display: flex;
-            justify-content: center;
-            align-items: center;
-            margin: 1.5rem 0 0.5rem 0;
-        }
-        .duo-dot {
-            width: 18px;
-            height: 18px;
-            border-radius: 50%;
-            background: #e0e0e0;
-            margin: 0 6px;
-            display: inline-block;
-            border: 2px solid #43b77a;
-            transition: background 0.2s, border 0.2s;
-        }
-        .duo-dot.active {
-            background: #43b77a;
-            border: 2px solid #ffd740;
-        }
-        .duo-dot.completed {
-            background: #ffd740;
-            border: 2px solid #43b77a;
-        }
-        .sidebar-profile {
-            background: #e3e5e8 !important;
-            border-radius: 18px;
-            padding: 1.2rem;
-            margin-bottom: 1.5rem;
-            text-align: center;
-            box-shadow: 0 2px 8px rgba(67,183,122,0.08);
-            position: relative;
-        }
-        .sidebar-profile .duo-mascot {
-            font-size: 3rem;
-            margin-bottom: 0.5rem;
-        }
-        .sidebar-profile .username {
-            font-size: 1.3rem;
-            font-weight: bold;
-            color: #43b77a;
-            margin-bottom: 0.2rem;
-        }
-        .sidebar-profile .level {
-            font-size: 1.1rem;
-            color: #ffd740;
-            font-weight: bold;
-        }
-        .sidebar-profile button#edit_profile_btn {
-            position: absolute;
-            top: 10px;
-            right: 10px;
-            padding: 2px 10px;
-            border-radius: 8px;
-            background: #43b77a !important;
-            color: #fff !important;
-            border: none;
-            font-weight: bold;
-            cursor: pointer;
-            font-size: 0.9rem;
-            transition: background 0.2s;
-        }
-        .sidebar-profile button#edit_profile_btn:hover {
-            background: #2e8c5e !important;
-        }
-        .stButton > button {
-            background-color: #43b77a !important;
-            color: #fff !important;
-            border-radius: 12px !important;
-            font-size: 1.1rem !important;
-            font-weight: bold !important;
-            padding: 0.7rem 2.2rem !important;
-            margin: 0.5rem 0 !important;
-            border: none !important;
-            box-shadow: 0 2px 8px rgba(67,183,122,0.08);
-            transition: background 0.2s;
-        }
-        .stButton > button:hover {
-            background-color: #2e8c5e !important;
-        }
-        /* Sidebar background and text */
-        section[data-testid="stSidebar"], .css-6qob1r, .stSidebar {
-            background-color: #f6fcf7 !important;
-            color: #222 !important;
-        }
-        /* Sidebar profile card text */
-        .sidebar-profile, .sidebar-profile * {
-            color: #222 !important;
-        }
-        .sidebar-profile .username {
-            color: #43b77a !important;
-        }
-        .sidebar-profile .level {
-            color: #ffd740 !important;
-        }
-        /* Sidebar headings and stats */
-        .stSidebar h1, .stSidebar h2, .stSidebar h3, .stSidebar h4, .stSidebar h5, .stSidebar h6, .stSidebar p, .stSidebar span, .stSidebar label, .stSidebar div {
-            color: #222 !important;
-        }
-        /* Input and select boxes */
-        .stTextInput input, .stSelectbox div[data-baseweb="select"], .stSelectbox, .stSelectbox input {
-            background-color: #fff !important;
-            color: #111 !important;
-            border: 1px solid #d0d4d7 !important;
-        }
-        .stTextInput input::placeholder {
-            color: #888 !important;
-        }
-        .stSelectbox span, .stSelectbox label, .stSelectbox div {
-            color: #111 !important;
-        }
-        /* General text color for main content and cards */
-        .main-header, .lesson-card, .question-card, .badge, .streak-counter, .duo-btn, .duo-dot, .sidebar-profile, .stApp, .block-container, .stMarkdown, .stDataFrame, .stTable, .stMetric, .stAlert, .stInfo, .stSuccess, .stWarning, .stError {
-            color: #111 !important;
-        }
-        /* Quiz answer choices (radio/checkbox labels) */
-        .stRadio label, .stCheckbox label {
-            color: #111 !important;
-        }
-        /* Back to lessons arrow */
-        .stApp svg, .stApp [data-testid="stAppViewContainer"] svg {
-            color: #43b77a !important;
-            fill: #43b77a !important;
-        }
-        /* Make selectbox (choose a page) match username input */
-        .stSelectbox__control, .stSelectbox__single-value, .stSelectbox__value-container, .stSelectbox__dropdown, .stSelectbox [data-baseweb="select"] {
-            background-color: #fff !important;
-            color: #111 !important;
-            border: 1px solid #d0d4d7 !important;
-        }
-        .stSelectbox__option, .stSelectbox__option span {
-            background-color: #fff !important;
-            color: #111 !important;
-        }
-        /* General text color for all light backgrounds */
-        .main-header, .lesson-card, .question-card, .badge, .streak-counter, .duo-btn, .duo-dot, .sidebar-profile, .stApp, .block-container, .stMarkdown, .stDataFrame, .stTable, .stMetric, .stAlert, .stInfo, .stSuccess, .stWarning, .stError, .stSidebar, .stSidebar *, .stTextInput input, .stSelectbox__single-value, .stSelectbox__option, .stSelectbox__option span, .stSelectbox label, .stSelectbox span, .stSelectbox__value-container, .stSelectbox__dropdown, .stRadio label, .stCheckbox label, .stButton > button, .stSelectbox__control {
-            color: #111 !important;
-        }
-        /* Force all main content text under the FinIQ dashboard to black */
-        .block-container, .block-container * {
-            color: #111 !important;
-        }
-        /* Lesson navigation selectbox (top left in lesson) */
-        .stSelectbox__control, .stSelectbox__single-value, .stSelectbox__value-container, .stSelectbox__dropdown, .stSelectbox [data-baseweb="select"] {
-            background-color: #fff !important;
-            color: #111 !important;
-            border: 1px solid #d0d4d7 !important;
-        }
-        .stSelectbox__option, .stSelectbox__option span {
-            background-color: #fff !important;
-            color: #111 !important;
-        }
-        /* Sidebar navigation selectbox (force app theme color) */
-        .stSelectbox__control, .stSelectbox__single-value, .stSelectbox__value-container {
-            background-color: #43b77a !important;
-            color: #fff !important;
-            border: 1px solid #43b77a !important;
-        }
-        .stSelectbox__dropdown {
-            background-color: #fff !important;
-        }
-        .stSelectbox__option, .stSelectbox__option span {
-            background-color: #fff !important;
-            color: #111 !important;
-        }
-        .stSelectbox__single-value {
-            color: #fff !important;
-        }
-        /* Force selectbox input to app green and white */
-        .stSelectbox__control, .stSelectbox__single-value, .stSelectbox__value-container {
-            background-color: #43b77a !important;
-            color: #fff !important;
-            border: 1px solid #43b77a !important;
-        }
-        .stSelectbox__single-value, .stSelectbox__placeholder {
-            color: #fff !important;
-        }
-        /* Force dropdown menu to white background and dark text */
-        .stSelectbox__menu, .stSelectbox__menu-list, .stSelectbox__option, .stSelectbox__option span {
-            background-color: #fff !important;
-            color: #111 !important;
-        }
-        .stSelectbox__option--is-selected, .stSelectbox__option--is-focused {
-            background-color: #e6f9ed !important;
-            color: #222 !important;
-        }
-        /* Target Streamlit's internal react-select classes for extra force */
-        [data-baseweb="select"] .css-1wa3eu0-placeholder,
-        [data-baseweb="select"] .css-1uccc91-singleValue {
-            color: #fff !important;
-        }
-        [data-baseweb="select"] .css-1okebmr-indicatorSeparator {
-            background-color: #43b77a !important;
-        }
-        [data-baseweb="select"] .css-1pahdxg-control {
-            background-color: #43b77a !important;
-            color: #fff !important;
-            border: 1px solid #43b77a !important;
-        }
-        [data-baseweb="select"] .css-1dimb5e-menu {
-            background-color: #fff !important;
-            color: #111 !important;
-        }
-        [data-baseweb="select"] .css-1n7v3ny-option {
-            background-color: #fff !important;
-            color: #111 !important;
-        }
-        [data-baseweb="select"] .css-1n7v3ny-option[aria-selected="true"],
-        [data-baseweb="select"] .css-1n7v3ny-option:hover {
-            background-color: #e6f9ed !important;
-            color: #222 !important;
-        }
-        /* Profile edit selectboxes (avatar/account type) - main box light green */
-        .stSelectbox__control, .stSelectbox__value-container, .stSelectbox__single-value {
-            background-color: #e6f9ed !important;
-            color: #111 !important;
-            border: 1.5px solid #43b77a !important;
-        }
-        .stSelectbox__dropdown {
-            background-color: #fff !important;
-        }
-        .stSelectbox__option, .stSelectbox__option span {
-            background-color: #fff !important;
-            color: #111 !important;
-        }
-        .stSelectbox__single-value, .stSelectbox__placeholder {
-            color: #111 !important;
-        }
-        /* Extra force for Streamlit/react-select classes in profile edit */
-        [data-baseweb="select"] .css-1pahdxg-control {
-            background-color: #e6f9ed !important;
-            color: #111 !important;
-            border: 1.5px solid #43b77a !important;
-        }
-        [data-baseweb="select"] .css-1uccc91-singleValue,
-        [data-baseweb="select"] .css-1wa3eu0-placeholder {
-            color: #111 !important;
-        }
-        /* Username input box - thinner black outline */
-        .stTextInput input {
-            border: 1.5px solid #222 !important;
-            box-shadow: none !important;
-        }
-        /* Remove the white line (indicator separator) in the navigation selectbox */
-        .css-1okebmr-indicatorSeparator {
-            background-color: transparent !important;
-            width: 0 !important;
-        }
-        </style>
-        """, unsafe_allow_html=True)
-    else:
-        # Night mode: the old greenish 'light' theme
-        st.markdown("""
-        <style>
-        .stApp, .block-container {
-            background-color: #f6f9f6;
-        }
-        body {
-            background-color: #f6f9f6;
-        }
-        .main-header {
-            font-size: 2.5rem;
-            font-weight: bold;
-            color: #43b77a;
-            text-align: center;
-            margin-bottom: 1.5rem;
-            letter-spacing: 1px;
-        }
-        .duo-mascot {
-            font-size: 2.5rem;
-            margin-right: 0.5rem;
-            vertical-align: middle;
-        }
-        .lesson-card {
-            background: linear-gradient(90deg, #e6f9ed 60%, #f6f9f6 100%);
-            padding: 1.5rem;
-            border-radius: 18px;
-            margin: 1.2rem 0;
-            border-left: 8px solid #43b77a;
-            box-shadow: 0 2px 8px rgba(67,183,122,0.08);
-            transition: box-shadow 0.2s;
-        }
-        .lesson-card:hover {
-            box-shadow: 0 4px 16px rgba(67,183,122,0.18);
-        }
-        .question-card {
-            background: linear-gradient(90deg, #fffbe6 60%, #f6f9f6 100%);
-            padding: 2rem;
-            border-radius: 18px;
-            margin: 1.5rem 0;
-            box-shadow: 0 2px 8px rgba(255,215,64,0.08);
-            border: 2px solid #ffd740;
-        }
-        .badge {
-            display: inline-block;
-            background-color: #ffd700;
-            color: #000;
-            padding: 0.5rem 1rem;
-            border-radius: 20px;
-            margin: 0.25rem;
-            font-weight: bold;
-        }
-        .streak-counter {
-            background: linear-gradient(45deg, #ff6b6b, #ffa500);
-            color: white;
-            padding: 1rem;
-            border-radius: 10px;
-            text-align: center;
-            margin: 1rem 0;
-        }
-        .duo-btn {
-            background-color: #43b77a !important;
-            color: #fff !important;
-            border-radius: 12px !important;
-            font-size: 1.1rem !important;
-            font-weight: bold !important;
-            padding: 0.7rem 2.2rem !important;
-            margin: 0.5rem 0 !important;
-            border: none !important;
-            box-shadow: 0 2px 8px rgba(67,183,122,0.08);
-            transition: background 0.2s;
-        }
-        .duo-btn:hover {
-            background-color: #2e8c5e !important;
-        }
-        .duo-progress {
-            display: flex;
-            justify-content: center;
-            align-items: center;
-            margin: 1.5rem 0 0.5rem 0;
-        }
-        .duo-dot {
-            width: 18px;
-            height: 18px;
-            border-radius: 50%;
-            background: #e0e0e0;
-            margin: 0 6px;
-            display: inline-block;
-            border: 2px solid #43b77a;
-            transition: background 0.2s, border 0.2s;
-        }
-        .duo-dot.active {
-            background: #43b77a;
-            border: 2px solid #ffd740;
-        }
-        .duo-dot.completed {
-            background: #ffd740;
-            border: 2px solid #43b77a;
-        }
-        .sidebar-profile {
-            background: linear-gradient(90deg, #e6f9ed 60%, #f6f9f6 100%);
-            border-radius: 18px;
-            padding: 1.2rem;
-            margin-bottom: 1.5rem;
-            text-align: center;
-            box-shadow: 0 2px 8px rgba(67,183,122,0.08);
-        }
-        .sidebar-profile .duo-mascot {
-            font-size: 3rem;
-            margin-bottom: 0.5rem;
-        }
-        .sidebar-profile .username {
-            font-size: 1.3rem;
-            font-weight: bold;
-            color: #43b77a;
-            margin-bottom: 0.2rem;
-        }
-        .sidebar-profile .level {
-            font-size: 1.1rem;
-            color: #ffd740;
-            font-weight: bold;
-        }
-        .stButton > button {
-            background-color: #43b77a !important;
-            color: #fff !important;
-            border-radius: 12px !important;
-            font-size: 1.1rem !important;
-            font-weight: bold !important;
-            padding: 0.7rem 2.2rem !important;
-            margin: 0.5rem 0 !important;
-            border: none !important;
-            box-shadow: 0 2px 8px rgba(67,183,122,0.08);
-            transition: background 0.2s;
-        }
-        .stButton > button:hover {
-            background-color: #2e8c5e !important;
-        }
-        </style>
-        """, unsafe_allow_html=True)
+# One stylesheet built on CSS custom properties, minified once per process and
+# sent to a browser once per session. Switching between light and night mode
+# only sends the small :root block of --fq-* variables.
 
-# --- END THEME CSS ---
+# Shared by both themes; colours that differ between them come from the
+# --fq-* custom properties in THEME_VARIABLES
+THEME_CSS = """
+.stApp, .block-container {
+    background-color: var(--fq-app-bg) !important;
+}
+body {
+    background-color: var(--fq-app-bg) !important;
+    color: #222 !important;
+}
+.main-header {
+    font-size: 2.5rem;
+    font-weight: bold;
+    color: #43b77a;
+    text-align: center;
+    margin-bottom: 1.5rem;
+    letter-spacing: 1px;
+}
+.duo-mascot {
+    font-size: 2.5rem;
+    margin-right: 0.5rem;
+    vertical-align: middle;
+}
+.lesson-card {
+    background: var(--fq-lesson-card-bg) !important;
+    padding: 1.5rem;
+    border-radius: 18px;
+    margin: 1.2rem 0;
+    border-left: 8px solid #43b77a;
+    box-shadow: 0 2px 8px rgba(67,183,122,0.08);
+    transition: box-shadow 0.2s;
+}
+.lesson-card:hover {
+    box-shadow: 0 4px 16px rgba(67,183,122,0.18);
+}
+.question-card {
+    background: var(--fq-question-card-bg) !important;
+    padding: 2rem;
+    border-radius: 18px;
+    margin: 1.5rem 0;
+    box-shadow: 0 2px 8px var(--fq-question-card-shadow);
+    border: 2px solid var(--fq-question-card-border);
+}
+.badge {
+    display: inline-block;
+    background-color: var(--fq-badge-bg);
+    color: var(--fq-badge-text);
+    padding: 0.5rem 1rem;
+    border-radius: 20px;
+    margin: 0.25rem;
+    font-weight: bold;
+}
+.streak-counter {
+    background: var(--fq-streak-bg);
+    color: #fff;
+    padding: 1rem;
+    border-radius: 10px;
+    text-align: center;
+    margin: 1rem 0;
+}
+.duo-btn {
+    background-color: #43b77a !important;
+    color: #fff !important;
+    border-radius: 12px !important;
+    font-size: 1.1rem !important;
+    font-weight: bold !important;
+    padding: 0.7rem 2.2rem !important;
+    margin: 0.5rem 0 !important;
+    border: none !important;
+    box-shadow: 0 2px 8px rgba(67,183,122,0.08);
+    transition: background 0.2s;
+}
+.duo-btn:hover {
+    background-color: #2e8c5e !important;
+}
+.duo-progress {
+    display: flex;
+    justify-content: center;
+    align-items: center;
+    margin: 1.5rem 0 0.5rem 0;
+}
+.duo-dot {
+    width: 18px;
+    height: 18px;
+    border-radius: 50%;
+    background: #e0e0e0;
+    margin: 0 6px;
+    display: inline-block;
+    border: 2px solid #43b77a;
+    transition: background 0.2s, border 0.2s;
+}
+.duo-dot.active {
+    background: #43b77a;
+    border: 2px solid #ffd740;
+}
+.duo-dot.completed {
+    background: #ffd740;
+    border: 2px solid #43b77a;
+}
+.sidebar-profile {
+    background: var(--fq-sidebar-profile-bg) !important;
+    border-radius: 18px;
+    padding: 1.2rem;
+    margin-bottom: 1.5rem;
+    text-align: center;
+    box-shadow: 0 2px 8px rgba(67,183,122,0.08);
+    position: relative;
+}
+.sidebar-profile .duo-mascot {
+    font-size: 3rem;
+    margin-bottom: 0.5rem;
+}
+.sidebar-profile .username {
+    font-size: 1.3rem;
+    font-weight: bold;
+    color: #43b77a;
+    margin-bottom: 0.2rem;
+}
+.sidebar-profile .level {
+    font-size: 1.1rem;
+    color: #ffd740;
+    font-weight: bold;
+}
+.sidebar-profile button#edit_profile_btn {
+    position: absolute;
+    top: 10px;
+    right: 10px;
+    padding: 2px 10px;
+    border-radius: 8px;
+    background: #43b77a !important;
+    color: #fff !important;
+    border: none;
+    font-weight: bold;
+    cursor: pointer;
+    font-size: 0.9rem;
+    transition: background 0.2s;
+}
+.sidebar-profile button#edit_profile_btn:hover {
+    background: #2e8c5e !important;
+}
+.stButton > button {
+    background-color: #43b77a !important;
+    color: #fff !important;
+    border-radius: 12px !important;
+    font-size: 1.1rem !important;
+    font-weight: bold !important;
+    padding: 0.7rem 2.2rem !important;
+    margin: 0.5rem 0 !important;
+    border: none !important;
+    box-shadow: 0 2px 8px rgba(67,183,122,0.08);
+    transition: background 0.2s;
+}
+.stButton > button:hover {
+    background-color: #2e8c5e !important;
+}
+/* Sidebar background and text */
+section[data-testid="stSidebar"], .css-6qob1r, .stSidebar {
+    background-color: var(--fq-sidebar-bg) !important;
+    color: #222 !important;
+}
+/* Sidebar profile card text */
+.sidebar-profile, .sidebar-profile * {
+    color: #222 !important;
+}
+.sidebar-profile .username {
+    color: #43b77a !important;
+}
+.sidebar-profile .level {
+    color: #ffd740 !important;
+}
+/* Sidebar headings and stats */
+.stSidebar h1, .stSidebar h2, .stSidebar h3, .stSidebar h4, .stSidebar h5, .stSidebar h6, .stSidebar p, .stSidebar span, .stSidebar label, .stSidebar div {
+    color: #222 !important;
+}
+/* Input and select boxes */
+.stTextInput input, .stSelectbox div[data-baseweb="select"], .stSelectbox, .stSelectbox input {
+    background-color: #fff !important;
+    color: #111 !important;
+    border: 1px solid #d0d4d7 !important;
+}
+.stTextInput input::placeholder {
+    color: #888 !important;
+}
+.stSelectbox span, .stSelectbox label, .stSelectbox div {
+    color: #111 !important;
+}
+/* General text color for main content and cards */
+.main-header, .lesson-card, .question-card, .badge, .streak-counter, .duo-btn, .duo-dot, .sidebar-profile, .stApp, .block-container, .stMarkdown, .stDataFrame, .stTable, .stMetric, .stAlert, .stInfo, .stSuccess, .stWarning, .stError {
+    color: #111 !important;
+}
+/* Quiz answer choices (radio/checkbox labels) */
+.stRadio label, .stCheckbox label {
+    color: #111 !important;
+}
+/* Back to lessons arrow */
+.stApp svg, .stApp [data-testid="stAppViewContainer"] svg {
+    color: #43b77a !important;
+    fill: #43b77a !important;
+}
+/* Make selectbox (choose a page) match username input */
+.stSelectbox__control, .stSelectbox__single-value, .stSelectbox__value-container, .stSelectbox__dropdown, .stSelectbox [data-baseweb="select"] {
+    background-color: #fff !important;
+    color: #111 !important;
+    border: 1px solid #d0d4d7 !important;
+}
+.stSelectbox__option, .stSelectbox__option span {
+    background-color: #fff !important;
+    color: #111 !important;
+}
+/* General text color for all light backgrounds */
+.main-header, .lesson-card, .question-card, .badge, .streak-counter, .duo-btn, .duo-dot, .sidebar-profile, .stApp, .block-container, .stMarkdown, .stDataFrame, .stTable, .stMetric, .stAlert, .stInfo, .stSuccess, .stWarning, .stError, .stSidebar, .stSidebar *, .stTextInput input, .stSelectbox__single-value, .stSelectbox__option, .stSelectbox__option span, .stSelectbox label, .stSelectbox span, .stSelectbox__value-container, .stSelectbox__dropdown, .stRadio label, .stCheckbox label, .stButton > button, .stSelectbox__control {
+    color: #111 !important;
+}
+/* Force all main content text under the FinIQ dashboard to black */
+.block-container, .block-container * {
+    color: #111 !important;
+}
+/* Lesson navigation selectbox (top left in lesson) */
+.stSelectbox__control, .stSelectbox__single-value, .stSelectbox__value-container, .stSelectbox__dropdown, .stSelectbox [data-baseweb="select"] {
+    background-color: #fff !important;
+    color: #111 !important;
+    border: 1px solid #d0d4d7 !important;
+}
+.stSelectbox__option, .stSelectbox__option span {
+    background-color: #fff !important;
+    color: #111 !important;
+}
+/* Sidebar navigation selectbox (force app theme color) */
+.stSelectbox__control, .stSelectbox__single-value, .stSelectbox__value-container {
+    background-color: #43b77a !important;
+    color: #fff !important;
+    border: 1px solid #43b77a !important;
+}
+.stSelectbox__dropdown {
+    background-color: #fff !important;
+}
+.stSelectbox__option, .stSelectbox__option span {
+    background-color: #fff !important;
+    color: #111 !important;
+}
+.stSelectbox__single-value {
+    color: #fff !important;
+}
+/* Force selectbox input to app green and white */
+.stSelectbox__control, .stSelectbox__single-value, .stSelectbox__value-container {
+    background-color: #43b77a !important;
+    color: #fff !important;
+    border: 1px solid #43b77a !important;
+}
+.stSelectbox__single-value, .stSelectbox__placeholder {
+    color: #fff !important;
+}
+/* Force dropdown menu to white background and dark text */
+.stSelectbox__menu, .stSelectbox__menu-list, .stSelectbox__option, .stSelectbox__option span {
+    background-color: #fff !important;
+    color: #111 !important;
+}
+.stSelectbox__option--is-selected, .stSelectbox__option--is-focused {
+    background-color: #e6f9ed !important;
+    color: #222 !important;
+}
+/* Target Streamlit's internal react-select classes for extra force */
+[data-baseweb="select"] .css-1wa3eu0-placeholder,
+[data-baseweb="select"] .css-1uccc91-singleValue {
+    color: #fff !important;
+}
+[data-baseweb="select"] .css-1okebmr-indicatorSeparator {
+    background-color: #43b77a !important;
+}
+[data-baseweb="select"] .css-1pahdxg-control {
+    background-color: #43b77a !important;
+    color: #fff !important;
+    border: 1px solid #43b77a !important;
+}
+[data-baseweb="select"] .css-1dimb5e-menu {
+    background-color: #fff !important;
+    color: #111 !important;
+}
+[data-baseweb="select"] .css-1n7v3ny-option {
+    background-color: #fff !important;
+    color: #111 !important;
+}
+[data-baseweb="select"] .css-1n7v3ny-option[aria-selected="true"],
+[data-baseweb="select"] .css-1n7v3ny-option:hover {
+    background-color: #e6f9ed !important;
+    color: #222 !important;
+}
+/* Profile edit selectboxes (avatar/account type) - main box light green */
+.stSelectbox__control, .stSelectbox__value-container, .stSelectbox__single-value {
+    background-color: #e6f9ed !important;
+    color: #111 !important;
+    border: 1.5px solid #43b77a !important;
+}
+.stSelectbox__dropdown {
+    background-color: #fff !important;
+}
+.stSelectbox__option, .stSelectbox__option span {
+    background-color: #fff !important;
+    color: #111 !important;
+}
+.stSelectbox__single-value, .stSelectbox__placeholder {
+    color: #111 !important;
+}
+/* Extra force for Streamlit/react-select classes in profile edit */
+[data-baseweb="select"] .css-1pahdxg-control {
+    background-color: #e6f9ed !important;
+    color: #111 !important;
+    border: 1.5px solid #43b77a !important;
+}
+[data-baseweb="select"] .css-1uccc91-singleValue,
+[data-baseweb="select"] .css-1wa3eu0-placeholder {
+    color: #111 !important;
+}
+/* Username input box - thinner black outline */
+.stTextInput input {
+    border: 1.5px solid #222 !important;
+    box-shadow: none !important;
+}
+/* Remove the white line (indicator separator) in the navigation selectbox */
+.css-1okebmr-indicatorSeparator {
+    background-color: transparent !important;
+    width: 0 !important;
+}
+"""
+
+# Light mode is white & light green; night mode is the old greenish 'light' theme
+THEME_VARIABLES = {
+    False: {
+        'app-bg': '#fff',
+        'lesson-card-bg': '#f6fcf7',
+        'question-card-bg': '#fff',
+        'question-card-shadow': 'rgba(67,183,122,0.08)',
+        'question-card-border': '#43b77a',
+        'badge-bg': '#e6f9ed',
+        'badge-text': '#43b77a',
+        'streak-bg': 'linear-gradient(45deg, #ffb36b, #ffe066)',
+        'sidebar-profile-bg': '#e3e5e8',
+        'sidebar-bg': '#f6fcf7',
+    },
+    True: {
+        'app-bg': '#f6f9f6',
+        'lesson-card-bg': 'linear-gradient(90deg, #e6f9ed 60%, #f6f9f6 100%)',
+        'question-card-bg': 'linear-gradient(90deg, #fffbe6 60%, #f6f9f6 100%)',
+        'question-card-shadow': 'rgba(255,215,64,0.08)',
+        'question-card-border': '#ffd740',
+        'badge-bg': '#ffd700',
+        'badge-text': '#000',
+        'streak-bg': 'linear-gradient(45deg, #ff6b6b, #ffa500)',
+        'sidebar-profile-bg': 'linear-gradient(90deg, #e6f9ed 60%, #f6f9f6 100%)',
+        'sidebar-bg': '#e6f9ed',
+    },
+}
+
+# Sidebar profile card and lesson page rules shared by both themes
+COMPONENT_CSS = """
+.edit-profile-btn {
+    position: absolute;
+    top: 10px;
+    right: 10px;
+    z-index: 10;
+}
+.sidebar-profile { position: relative; }
+/* Make the Edit button match the Start Learning button */
+.stButton > button#profile-edit-btn {
+    background-color: #43b77a !important;
+    color: #fff !important;
+    border-radius: 12px !important;
+    font-size: 1.1rem !important;
+    font-weight: bold !important;
+    padding: 0.7rem 2.2rem !important;
+    margin: 0.5rem 0 !important;
+    border: none !important;
+    box-shadow: 0 2px 8px rgba(67,183,122,0.08);
+    transition: background 0.2s;
+}
+.stButton > button#profile-edit-btn:hover {
+    background-color: #2e8c5e !important;
+}
+/* Make only the Edit button green */
+.stButton > button[data-testid="baseButton-secondary-profile-edit-btn"] {
+    background-color: #43b77a !important;
+    color: #fff !important;
+    border-radius: 8px !important;
+    border: none !important;
+    font-size: 0.9rem !important;
+    font-weight: normal !important;
+    padding: 2px 14px !important;
+    position: absolute !important;
+    top: 10px !important;
+    right: 10px !important;
+    z-index: 10 !important;
+}
+.stButton > button[data-testid="baseButton-secondary-profile-edit-btn"]:hover {
+    background-color: #2e8c5e !important;
+}
+/* Back to Lessons button */
+div[data-testid="stButton"] button {
+    background: #43b77a;
+    color: #fff;
+    font-weight: bold;
+    font-size: 1.1rem;
+    padding: 0.5rem 1.5rem;
+    border-radius: 10px;
+    border: none;
+    cursor: pointer;
+}
+"""
+
+# Installs (or replaces) <style> elements in the app page. Running the script
+# from a zero-height component lets the styles outlive the element that
+# delivered them, so later reruns don't have to send anything.
+_THEME_LOADER_HTML = """<script>
+const doc = window.parent.document;
+for (const sheet of %s) {
+    let style = doc.getElementById(sheet.id);
+    if (!style) {
+        style = doc.createElement("style");
+        style.id = sheet.id;
+        doc.head.appendChild(style);
+    }
+    if (style.dataset.hash !== sheet.hash) {
+        style.textContent = sheet.css;
+        style.dataset.hash = sheet.hash;
+    }
+}
+</script>"""
+
+def minify_css(css):
+    """Strip comments and redundant whitespace from a stylesheet"""
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r':\s+', ':', css)
+    return css.replace(';}', '}').strip()
 
-# Add night_mode to session state
-if 'night_mode' not in st.session_state:
-    st.session_state.night_mode = False
+def _hashed(css):
+    return hashlib.sha1(css.encode('utf-8')).hexdigest()[:12], css
 
-# Inject theme CSS at the top of the app
-inject_theme_css(st.session_state.night_mode)
+@st.cache_resource
+def compile_theme_stylesheets():
+    """Minify and hash the stylesheet and both variable blocks once per server process"""
+    compiled = {'base': _hashed(minify_css(THEME_CSS + COMPONENT_CSS))}
+    for night_mode, variables in THEME_VARIABLES.items():
+        declarations = ';'.join(f'--fq-{name}:{value}' for name, value in variables.items())
+        compiled[night_mode] = _hashed(f':root{{{declarations}}}')
+    return compiled
+
+def inject_theme_css(night_mode=False):
+    """Send the stylesheet once per session and the variable block when the mode changes"""
+    compiled = compile_theme_stylesheets()
+    sent = st.session_state.setdefault('theme_css_sent', {})
+    pending = []
+    for element_id, (css_hash, css) in (("finiq-theme", compiled['base']),
+                                        ("finiq-theme-vars", compiled[night_mode])):
+        if sent.get(element_id) != css_hash:
+            pending.append({'id': element_id, 'hash': css_hash, 'css': css})
+            sent[element_id] = css_hash
+    if pending:
+        st.iframe(_THEME_LOADER_HTML % json.dumps(pending).replace('</', '<\\/'))  # sized to its (empty) content
+
+# --- END THEME CSS ---
 
-# Initialize session state
+# Initialize session state. Sessions signed in to the same profile share
+# one user_data object, see PROFILE PERSISTENCE.
 if 'user_data' not in st.session_state:
-    st.session_state.user_data = {
+    st.session_state.user_data = UserData({
         'username': '',
         'level': 1,
         'xp': 0,
         'coins': 100,
         'streak': 0,
         'last_login': None,
-        'completed_lessons': [],
-        'badges': [],
+        'activity': ActivityCalendar(),  # active and protected days, see check_streak()
+        'streak_protectors': 0,
+        'completed_lessons': {},  # ordered set: lesson name -> None, in completion order
+        'badges': set(),
+        'badge_progress': {},  # counter -> value, see badge_progress()
         'correct_answers': 0,
-        'total_questions': 0
-    }
+        'total_questions': 0,
+        'perfect_lessons': {},  # ordered set, like completed_lessons
+        'avatar': '🦖',
+        'account_type': 'Home',
+        'night_mode': False,
+        'avatar_unlocked': False,
+    })
 
 if 'current_lesson' not in st.session_state:
     st.session_state.current_lesson = None
@@ -522,19 +554,39 @@ if 'show_answer' not in st.session_state:
 if 'last_answer_correct' not in st.session_state:
     st.session_state.last_answer_correct = False
 
-if 'perfect_lessons' not in st.session_state:
-    st.session_state.perfect_lessons = []
+# Each opened lesson gets a fresh attempt id; completion is applied once per attempt
+if 'lesson_attempt_id' not in st.session_state:
+    st.session_state.lesson_attempt_id = None
+if 'attempt_correct' not in st.session_state:
+    st.session_state.attempt_correct = 0
+if 'completed_attempts' not in st.session_state:
+    st.session_state.completed_attempts = set()
+if 'completion_xp' not in st.session_state:
+    st.session_state.completion_xp = 0  # bonus XP the last completed attempt earned
+
+if 'flash_messages' not in st.session_state:
+    st.session_state.flash_messages = []
+if 'flash_balloons' not in st.session_state:
+    st.session_state.flash_balloons = False
+if 'sidebar_stale' not in st.session_state:
+    st.session_state.sidebar_stale = False
 
-# Add to session state initialization
-if 'avatar' not in st.session_state:
-    st.session_state.avatar = '🦖'
-if 'account_type' not in st.session_state:
-    st.session_state.account_type = 'Home'
 if 'show_profile_edit' not in st.session_state:
     st.session_state.show_profile_edit = False
-# In session state initialization, add avatar unlock tracking
-if 'avatar_unlocked' not in st.session_state:
-    st.session_state.avatar_unlocked = False
+
+# Saved profile this session is attached to (see PROFILE PERSISTENCE)
+if 'profile_token' not in st.session_state:
+    st.session_state.profile_token = None
+if 'profile_restored' not in st.session_state:
+    st.session_state.profile_restored = False
+if 'username_error' not in st.session_state:
+    st.session_state.username_error = None
+
+# Day check_streak() last ran for this session's profile
+if 'streak_checked_day' not in st.session_state:
+    st.session_state.streak_checked_day = None
+if 'longest_streak' not in st.session_state:
+    st.session_state.longest_streak = 0
 
 # Sample data for lessons and questions
 LESSONS_DATA = {
@@ -1324,16 +1376,7 @@ LESSONS_DATA = {
     }
 }
 
-# Badges system
-BADGES = {
-    "First Steps": {"requirement": "Complete your first lesson", "icon": "🎯"},
-    "Question Master": {"requirement": "Answer 10 questions correctly", "icon": "🧠"},
-    "Streak Champion": {"requirement": "Maintain a 7-day streak", "icon": "🔥"},
-    "Saver": {"requirement": "Earn 500 coins", "icon": "💰"},
-    "Dedicated Learner": {"requirement": "Complete 5 lessons", "icon": "📚"},
-    "Perfect Score": {"requirement": "Get 100% on a lesson", "icon": "⭐"},
-    "Century Club": {"requirement": "Answer 100 questions correctly", "icon": "🏆"}
-}
+
 
 # Leaderboard data (simulated)
 LEADERBOARD_DATA = [
@@ -1344,159 +1387,622 @@ LEADERBOARD_DATA = [
     {"username": "TaxGuru", "xp": 1200, "level": 3, "streak": 6}
 ]
 
+LEADERBOARD_COLUMNS = ['rank', 'username', 'xp', 'level', 'streak']
+# Marks the user's own row; a plain value, so no Styler has to run on every render
+LEADERBOARD_YOU = "👉 {} (you)"
+
+# Usernames suggested while typing in "Add a Friend"
+FRIEND_SUGGESTIONS = 5
+
+# Friend activity entries shown on the Friends page
+FEED_ENTRIES_SHOWN = 10
+
+# Worldwide leaderboard periods; None is the all-time board
+LEADERBOARD_PERIODS = {"All Time": None, "Today": "daily", "This Week": "weekly", "This Month": "monthly"}
+
+# Worldwide leaderboard window: the top rows, plus this many rows either side of the user
+LEADERBOARD_TOP = 10
+LEADERBOARD_AROUND = 3
+
+# Streak lengths worth telling friends about
+STREAK_MILESTONES = (3, 7, 14, 30, 50, 100, 365)
+
 def check_streak():
-    """Check and update user's daily streak"""
+    """Record today's visit and update the user's daily streak, once per session per day
+
+    Streak Protector tokens cover the days missed since the last visit, as
+    long as there are enough of them to cover the whole gap.
+    """
     today = datetime.date.today()
-    if st.session_state.user_data['last_login'] is None:
-        st.session_state.user_data['last_login'] = today.strftime('%Y-%m-%d')
-        st.session_state.user_data['streak'] = 1
-    else:
-        last_login = datetime.datetime.strptime(st.session_state.user_data['last_login'], '%Y-%m-%d').date()
-        if today == last_login:
-            return  # Already logged in today
-        elif today - last_login == datetime.timedelta(days=1):
-            st.session_state.user_data['streak'] += 1
-        else:
-            st.session_state.user_data['streak'] = 1
-        st.session_state.user_data['last_login'] = today.strftime('%Y-%m-%d')
+    if st.session_state.streak_checked_day == today:
+        return
+    st.session_state.streak_checked_day = today
+    user_data = st.session_state.user_data
+    calendar = user_data['activity']
+    if calendar.is_active(today):
+        st.session_state.longest_streak = calendar.longest_streak()
+        return  # Already logged in today
+    used = calendar.protect_gap(today, user_data['streak_protectors'])
+    if used:
+        user_data['streak_protectors'] -= used
+        flash(f"🛡️ Streak Protector covered {used} missed day{'s' if used > 1 else ''}!")
+    calendar.mark_active(today)
+    user_data['streak'] = calendar.current_streak(today)
+    user_data['last_login'] = today.isoformat()
+    st.session_state.longest_streak = calendar.longest_streak()
+    if user_data['streak'] in STREAK_MILESTONES:
+        post_activity(f"🔥 reached a {user_data['streak']}-day streak")
+    new_badges = check_badges(badges.STREAK)
+    if new_badges:
+        announce_badges(new_badges)
+    persist_profile()
 
-def check_badges():
-    """Check if user has earned new badges"""
+def badge_counter(counter):
+    """Current value of one of the counters badge rules depend on"""
+    if counter == badges.COMPLETED_LESSONS:
+        return len(st.session_state.user_data['completed_lessons'])
+    if counter == badges.PERFECT_LESSONS:
+        return len(st.session_state.user_data['perfect_lessons'])
+    return st.session_state.user_data[counter]
+
+def badge_progress(counter):
+    """Progress towards the badges on one counter, as last recorded by check_badges()"""
+    progress = st.session_state.user_data['badge_progress']
+    if counter not in progress:
+        progress[counter] = badge_counter(counter)  # first look at this counter for this profile
+    return progress[counter]
+
+def check_badges(*counters):
+    """Award the badges unlocked by the counters that just changed; returns the new ones
+
+    Also records each counter's value, which the Rewards page shows as progress.
+    """
+    earned = st.session_state.user_data['badges']
+    progress = st.session_state.user_data['badge_progress']
     new_badges = []
-    
-    # First Steps
-    if len(st.session_state.user_data['completed_lessons']) >= 1 and "First Steps" not in st.session_state.user_data['badges']:
-        new_badges.append("First Steps")
-    
-    # Question Master
-    if st.session_state.user_data['correct_answers'] >= 10 and "Question Master" not in st.session_state.user_data['badges']:
-        new_badges.append("Question Master")
-    
-    # Streak Champion
-    if st.session_state.user_data['streak'] >= 7 and "Streak Champion" not in st.session_state.user_data['badges']:
-        new_badges.append("Streak Champion")
-    
-    # Saver
-    if st.session_state.user_data['coins'] >= 500 and "Saver" not in st.session_state.user_data['badges']:
-        new_badges.append("Saver")
-    
-    # Dedicated Learner
-    if len(st.session_state.user_data['completed_lessons']) >= 5 and "Dedicated Learner" not in st.session_state.user_data['badges']:
-        new_badges.append("Dedicated Learner")
-    
-    # Century Club
-    if st.session_state.user_data['correct_answers'] >= 100 and "Century Club" not in st.session_state.user_data['badges']:
-        new_badges.append("Century Club")
-    
-    for badge in new_badges:
-        st.session_state.user_data['badges'].append(badge)
-    
+    for counter in counters:
+        progress[counter] = badge_counter(counter)
+        for badge in badges.newly_earned(counter, progress[counter], earned):
+            earned.add(badge)
+            new_badges.append(badge)
     return new_badges
 
+def announce_badges(new_badges):
+    flash(f"🎉 New badge earned: {', '.join(new_badges)}", balloons=True)
+    for badge in new_badges:
+        post_activity(f"{BADGES[badge]['icon']} earned the {badge} badge")
+
+@st.cache_resource
+def get_level_curve():
+    """XP thresholds per level, loaded once per server process"""
+    return load_curve()
+
 # Utility function to recalculate level based on XP
 def recalculate_level():
-    st.session_state.user_data['level'] = 1 + (st.session_state.user_data['xp'] // 400)
+    st.session_state.user_data['level'] = get_level_curve().level(st.session_state.user_data['xp'])
+
+@st.cache_resource
+def get_effects():
+    """Timed shop effects (XP Booster and the like) per server process"""
+    return EffectScheduler()
+
+def award_xp(amount):
+    """Give the user XP, boosted by any running effects; returns the XP actually given
+
+    The XP also counts towards today's, this week's and this month's boards.
+    """
+    user_data = st.session_state.user_data
+    if user_data['username']:
+        amount *= get_effects().xp_multiplier(user_data['username'])
+    user_data['xp'] += amount
+    recalculate_level()
+    if user_data['username']:
+        today = datetime.date.today()
+        daily_xp = get_xp_windows().add(user_data['username'], amount, user_data['level'], user_data['streak'], today)
+        get_journal().append(xp_event(st.session_state.profile_token, user_data['username'], today, daily_xp))
+    return amount
+
+# --- PROFILE PERSISTENCE ---
+# Profiles are saved to SQLite (see storage.py) under the username. The URL
+# carries the profile's random token as ?sid=..., so refreshing the page or
+# restarting the server picks the same profile back up, and every tab open
+# on it shares one user_data object (see sessions.py). Saves go through the
+# write-behind journal (see journal.py), so a click never waits on disk.
+USER_DATA_KEYS = (
+    'username', 'level', 'xp', 'coins', 'streak', 'last_login',
+    'completed_lessons', 'badges', 'correct_answers', 'total_questions',
+    'badge_progress', 'activity', 'streak_protectors', 'perfect_lessons',
+    'avatar', 'account_type', 'night_mode', 'avatar_unlocked',
+)
+
+@st.cache_resource
+def get_profile_store():
+    """One profile store (and connection pool) per server process"""
+    return ProfileStore()
+
+@st.cache_resource
+def get_journal():
+    """One journal writer thread per server process; replays leftovers on start"""
+    return EventJournal(DEFAULT_JOURNAL_PATH, get_profile_store().apply_events)
+
+@st.cache_resource
+def get_leaderboard():
+    """One ranked leaderboard per server process, seeded from the stored profiles"""
+    get_journal().sync()
+    return Leaderboard(LEADERBOARD_DATA + get_profile_store().leaderboard_rows())
+
+@st.cache_resource
+def get_xp_windows():
+    """Daily, weekly and monthly leaderboards per server process, seeded from the XP buckets"""
+    get_journal().sync()
+    store = get_profile_store()
+    since = earliest_period_start(datetime.date.today())
+    store.prune_xp_buckets(since)
+    return WindowedLeaderboards(store.xp_bucket_rows(since))
+
+@st.cache_resource
+def get_leaderboard_snapshots():
+    """One background refresher per server process; sessions only ever read its snapshots"""
+    leaderboard = get_leaderboard()
+    xp_windows = get_xp_windows()
+
+    def boards():
+        current = {window: xp_windows.board(window) for window in WINDOWS}
+        current[None] = (None, leaderboard)
+        return current
+    return SnapshotPublisher(boards)
+
+@st.cache_resource
+def get_friend_graph():
+    """One friend graph per server process, shared by every session"""
+    get_journal().sync()
+    return FriendGraph(*get_profile_store().friend_graph_rows())
+
+@st.cache_resource
+def get_friend_rankings():
+    """Friends leaderboards per server process, cached per user"""
+    return FriendRankings(get_friend_graph(), get_leaderboard())
+
+@st.cache_resource
+def get_activity_feed():
+    """Friend activity feeds per server process"""
+    return ActivityFeed(get_friend_graph())
+
+@st.cache_resource
+def get_friend_suggestions():
+    """People-you-may-know lists per server process, rebuilt in the background"""
+    graph = get_friend_graph()
+    store = get_profile_store()
+    return FriendSuggestions(lambda: (graph.edges(), store.completed_lessons()))
+
+def post_activity(message):
+    """Tell the user's friends what they just did; guests have no friends to tell"""
+    if st.session_state.user_data['username']:
+        get_activity_feed().post(st.session_state.user_data['username'], message)
+
+def publish_stats():
+    """Move the signed-in user to their current place on the shared leaderboards"""
+    user_data = st.session_state.user_data
+    if get_leaderboard().update(user_data['username'], user_data['xp'], user_data['level'], user_data['streak']):
+        get_friend_rankings().invalidate(user_data['username'])
+    get_xp_windows().update_stats(user_data['username'], user_data['level'], user_data['streak'])
+
+def profile_from_session():
+    """Collect everything worth saving from the session into one flat dict"""
+    profile = {key: st.session_state.user_data[key] for key in USER_DATA_KEYS}
+    profile.update(
+        completed_lessons=list(st.session_state.user_data['completed_lessons']),
+        badges=badges.in_display_order(st.session_state.user_data['badges']),
+        badge_progress=dict(st.session_state.user_data['badge_progress']),
+        activity=st.session_state.user_data['activity'].to_dict(),
+        effects=get_effects().active(st.session_state.user_data['username']),
+        token=st.session_state.profile_token,
+        perfect_lessons=list(st.session_state.user_data['perfect_lessons']),
+    )
+    return profile
+
+@st.cache_resource
+def get_open_profiles():
+    """The user_data of every profile some session is signed in to, per server process"""
+    return OpenProfiles()
+
+def load_user_data(token):
+    """Build a stored profile's user_data, or None if no profile has this token"""
+    get_journal().sync()  # another tab may have saves still in flight
+    profile = get_profile_store().load_profile_by_token(token)
+    if not profile:
+        return None
+    user_data = UserData((key, profile[key]) for key in USER_DATA_KEYS)
+    user_data['completed_lessons'] = dict.fromkeys(profile['completed_lessons'])
+    user_data['perfect_lessons'] = dict.fromkeys(profile['perfect_lessons'])
+    user_data['badges'] = set(profile['badges'])
+    activity = ActivityCalendar.from_dict(profile['activity'])
+    if not activity and profile['last_login']:
+        # Saved before activity calendars: rebuild the streak that ended on last_login
+        activity = ActivityCalendar.seeded(datetime.date.fromisoformat(profile['last_login']), profile['streak'])
+    user_data['activity'] = activity
+    # In case the level curve changed since it was saved
+    user_data['level'] = get_level_curve().level(user_data['xp'])
+    get_effects().restore(profile['username'], profile['effects'])
+    return user_data
+
+def restore_profile():
+    """On a session's first run, reattach the profile named by ?sid= in the URL
+
+    A profile another tab already has open is shared with it, not reloaded.
+    """
+    if st.session_state.profile_restored:
+        return
+    st.session_state.profile_restored = True
+    token = st.query_params.get("sid")
+    if token and not st.session_state.user_data['username']:
+        user_data = get_open_profiles().open(token, lambda: load_user_data(token))
+        if user_data is not None:
+            st.session_state.user_data = user_data
+            st.session_state.profile_token = token
+            st.session_state.streak_checked_day = None  # check the loaded profile's streak
+
+@st.cache_resource
+def get_username_index():
+    """Every registered username, for existence checks and autocomplete"""
+    return UsernameIndex(get_profile_store().usernames())
+
+USERNAME_TAKEN = "The username '{}' is already taken."
+SAVES_PENDING = "Your progress is still being saved. Please try again in a moment."
+
+def claim_username(username):
+    """Create or rename the session's stored profile; returns why it could not, or None
+
+    Names are unique ignoring case, which the username index enforces.
+    """
+    # Pending saves must land under the old name first, and must not be
+    # replayed over the renamed or new profile on the next start
+    if not get_journal().sync(checkpoint=True):
+        return SAVES_PENDING
+    store = get_profile_store()
+    index = get_username_index()
+    old_username = st.session_state.user_data['username']
+    if old_username:
+        if not index.rename(old_username, username):
+            return USERNAME_TAKEN.format(username)
+        if not store.rename_profile(old_username, username):
+            index.rename(username, old_username)
+            return USERNAME_TAKEN.format(username)
+        st.session_state.user_data['username'] = username
+        get_leaderboard().remove(old_username)
+        get_xp_windows().rename(old_username, username)
+        get_effects().rename(old_username, username)
+        get_friend_graph().rename(old_username, username)
+        get_friend_rankings().invalidate(username)
+        publish_stats()
+        return None
+    if not index.add(username):
+        return USERNAME_TAKEN.format(username)
+    token = uuid.uuid4().hex
+    profile = profile_from_session()
+    profile.update(username=username, token=token)
+    if not store.create_profile(profile):
+        index.remove(username)
+        return USERNAME_TAKEN.format(username)
+    st.session_state.user_data['username'] = username
+    st.session_state.profile_token = token
+    get_open_profiles().add(token, st.session_state.user_data)
+    st.query_params["sid"] = token
+    publish_stats()
+    return None
+
+def persist_profile():
+    """Save the whole profile; guests (no username yet) are not saved"""
+    if st.session_state.user_data['username']:
+        get_journal().append(profile_event(profile_from_session()))
+        publish_stats()
+
+def persist_friend_event(action, other_username):
+    """Save one friend request, accept or decline made by the session's user"""
+    get_journal().append(friend_event(
+        st.session_state.profile_token, st.session_state.user_data['username'], action, other_username))
+    if action == "accept":
+        get_friend_rankings().invalidate(other_username)
+
+def persist_answer():
+    """Save just the counters a Submit Answer changes"""
+    user_data = st.session_state.user_data
+    if user_data['username']:
+        get_journal().append(answer_event(
+            st.session_state.profile_token, user_data['username'], user_data['total_questions'], user_data['correct_answers'],
+            user_data['xp'], user_data['coins'], user_data['level'], user_data['badge_progress']))
+        publish_stats()
+
+# --- END PROFILE PERSISTENCE ---
+
+# --- QUIZ STATE MACHINE ---
+# The quiz flow lives in current_lesson, question_index, show_answer,
+# selected_answer and lesson_completed. Every button changes it through an
+# on_click callback, which Streamlit runs before the script, so each click
+# costs a single render instead of a render followed by st.rerun().
+LESSON_LIST = "lesson_list"
+READING = "reading"
+QUESTION = "question"
+FEEDBACK = "feedback"
+COMPLETED = "completed"
+
+# event -> states it may fire from; clicks from any other state are ignored
+QUIZ_TRANSITIONS = {
+    "open_lesson": {LESSON_LIST},
+    "start_quiz": {READING},
+    "submit_answer": {QUESTION},
+    "next_question": {FEEDBACK},
+    "close_lesson": {READING, QUESTION, FEEDBACK, COMPLETED},
+}
+
+def quiz_state():
+    """Work out which step of the quiz flow the session is in"""
+    if not st.session_state.current_lesson:
+        return LESSON_LIST
+    if st.session_state.lesson_completed:
+        return COMPLETED
+    if st.session_state.question_index == 0:
+        return READING
+    if st.session_state.show_answer:
+        return FEEDBACK
+    return QUESTION
+
+def _can_fire(event):
+    return quiz_state() in QUIZ_TRANSITIONS[event]
+
+def reset_quiz(lesson_name=None):
+    """Put the quiz flow back at the start of lesson_name, or at the lesson list"""
+    st.session_state.current_lesson = lesson_name
+    st.session_state.question_index = 0
+    st.session_state.lesson_completed = False
+    st.session_state.show_answer = False
+    st.session_state.selected_answer = None
+    st.session_state.last_answer_correct = False
+    st.session_state.lesson_attempt_id = uuid.uuid4().hex if lesson_name else None
+    st.session_state.attempt_correct = 0
+
+def flash(message, balloons=False):
+    """Queue a success message for the next render"""
+    st.session_state.flash_messages.append(message)
+    if balloons:
+        st.session_state.flash_balloons = True
+
+def show_flash_messages():
+    """Render and clear any queued flash messages"""
+    if st.session_state.flash_balloons:
+        st.balloons()
+        st.session_state.flash_balloons = False
+    for message in st.session_state.flash_messages:
+        st.success(message)
+    st.session_state.flash_messages = []
+
+def sidebar_stats():
+    """Values shown in the sidebar that quiz answers can change"""
+    user_data = st.session_state.user_data
+    return (user_data['xp'], user_data['coins'], user_data['level'], len(user_data['badges']))
+
+def open_lesson(lesson_name):
+    if _can_fire("open_lesson"):
+        reset_quiz(lesson_name)
+
+def start_quiz():
+    if _can_fire("start_quiz"):
+        st.session_state.question_index = 1
+        st.session_state.show_answer = False
+        st.session_state.selected_answer = None
+
+def submit_answer(lesson_name):
+    if not _can_fire("submit_answer"):
+        return
+    stats_before = sidebar_stats()
+    questions = LESSONS_DATA[lesson_name]['questions']
+    question_data = questions[st.session_state.question_index - 1]
+    selected_answer = st.session_state[f"q{st.session_state.question_index}_radio"]
+    correct_answer = question_data['options'][question_data['correct']]
+    st.session_state.selected_answer = selected_answer
+    st.session_state.last_answer_correct = (selected_answer == correct_answer)
+    st.session_state.show_answer = True
+    st.session_state.user_data['total_questions'] += 1
+    changed = []
+    if st.session_state.last_answer_correct:
+        st.session_state.user_data['correct_answers'] += 1
+        st.session_state.attempt_correct += 1
+        award_xp(20)
+        st.session_state.user_data['coins'] += 10
+        changed += [badges.CORRECT_ANSWERS, badges.XP, badges.COINS]
+    completed = False
+    if st.session_state.question_index == len(questions):
+        completed = complete_lesson(lesson_name, st.session_state.lesson_attempt_id)
+    if completed:
+        changed += [badges.COMPLETED_LESSONS, badges.PERFECT_LESSONS, badges.XP, badges.COINS]
+    new_badges = check_badges(*dict.fromkeys(changed))
+    if new_badges:
+        announce_badges(new_badges)
+    if completed or new_badges:
+        persist_profile()
+    else:
+        persist_answer()
+    if sidebar_stats() != stats_before:
+        st.session_state.sidebar_stale = True
+
+def next_question():
+    if _can_fire("next_question"):
+        st.session_state.question_index += 1
+        st.session_state.show_answer = False
+        st.session_state.selected_answer = None
+
+def close_lesson():
+    if _can_fire("close_lesson"):
+        reset_quiz()
+
+def complete_lesson(lesson_name, attempt_id):
+    """Award the lesson completion bonus once per attempt; returns False if already applied"""
+    st.session_state.lesson_completed = True
+    if attempt_id is None or attempt_id in st.session_state.completed_attempts:
+        return False
+    st.session_state.completed_attempts.add(attempt_id)
+    user_data = st.session_state.user_data
+    user_data['completed_lessons'][lesson_name] = None
+    post_activity(f"✅ completed {lesson_name}")
+    st.session_state.completion_xp = award_xp(100)  # Bonus for completing lesson
+    user_data['coins'] += 50
+    # Perfect means every question right in this attempt
+    if st.session_state.attempt_correct == len(LESSONS_DATA[lesson_name]['questions']):
+        st.session_state.user_data['perfect_lessons'][lesson_name] = None
+    return True
+
+# --- END QUIZ STATE MACHINE ---
+
+def open_profile_editor():
+    st.session_state.show_profile_edit = True
+
+def save_profile_edit():
+    new_name = st.session_state.profile_name_input.strip()
+    if new_name and new_name != st.session_state.user_data['username']:
+        error = claim_username(new_name)
+        if error:
+            st.session_state.username_error = error
+    if st.session_state.user_data['avatar_unlocked']:
+        st.session_state.user_data['avatar'] = st.session_state.profile_avatar_select
+    st.session_state.user_data['account_type'] = st.session_state.profile_type_select
+    st.session_state.user_data['night_mode'] = st.session_state.night_mode_toggle
+    st.session_state.show_profile_edit = False
+    persist_profile()
+
+def cancel_profile_edit():
+    st.session_state.show_profile_edit = False
+
+def start_learning():
+    username = st.session_state.username_input.strip()
+    if username:
+        st.session_state.username_error = claim_username(username)
+
+def buy_item(item_name, price):
+    if st.session_state.user_data['coins'] < price:
+        return
+    st.session_state.user_data['coins'] -= price
+    check_badges(badges.COINS)  # nothing to earn, but keeps the Saver progress current
+    flash(f"🎉 Purchased {item_name}!")
+    if item_name == "Custom Avatar":
+        st.session_state.user_data['avatar_unlocked'] = True
+    elif item_name == "Streak Protector":
+        st.session_state.user_data['streak_protectors'] += 1
+    elif item_name in EFFECTS:
+        get_effects().activate(st.session_state.user_data['username'], item_name)
+    persist_profile()
+
+def pick_friend_suggestion(friend_username):
+    st.session_state.add_friend_input_main = friend_username
+
+def send_friend_request():
+    username = st.session_state.user_data['username']
+    typed = st.session_state.add_friend_input_main.strip()
+    friend_username = get_username_index().lookup(typed) if typed else None
+    if not username:
+        flash("⚠️ Enter your username in the sidebar before adding friends.")
+        return
+    if typed and friend_username is None:
+        flash(f"⚠️ There is no user called {typed}.")
+        return
+    if not friend_username or friend_username == username:
+        flash("⚠️ Enter a valid username (not your own).")
+        return
+    request_friend(friend_username)
+
+def request_friend(friend_username):
+    """Send a friend request from the session's user to an existing user"""
+    outcome = get_friend_graph().send_request(st.session_state.user_data['username'], friend_username)
+    if outcome in (ALREADY_SENT, ALREADY_FRIENDS):
+        flash("Already sent or already friends.")
+    elif outcome == ACCEPTED:
+        persist_friend_event("accept", friend_username)
+        flash(f"🤝 {friend_username} had already asked, so you are now friends!")
+    else:
+        persist_friend_event("request", friend_username)
+        flash(f"Friend request sent to {friend_username}!")
+
+def accept_friend(requester):
+    if get_friend_graph().accept(st.session_state.user_data['username'], requester):
+        persist_friend_event("accept", requester)
+        flash(f"You are now friends with {requester}!")
+
+def decline_friend(requester):
+    if get_friend_graph().decline(st.session_state.user_data['username'], requester):
+        persist_friend_event("decline", requester)
+        flash(f"Declined friend request from {requester}.")
+
+def show_friend_notices():
+    """Show friend requests and accepts other sessions have sent this user"""
+    if st.session_state.user_data['username']:
+        for notice in get_friend_graph().take_notices(st.session_state.user_data['username']):
+            st.toast(notice)
+
+def show_import_timings():
+    """Show how long each module import took in this server process"""
+    with st.expander("⏱️ Import Timings", expanded=True):
+        rows = import_timings()
+        if not rows:
+            st.write("No imports recorded yet.")
+        for row in rows:
+            kind = "lazy" if row['lazy'] else "startup"
+            st.markdown(f"`{row['module']}` – {row['ms']:.1f} ms ({kind})")
+        pending = [name for name, module in LAZY_MODULES.items() if not module.loaded]
+        if pending:
+            st.caption(f"Not loaded yet: {', '.join(pending)}")
 
 def main():
+    restore_profile()
+
+    # Inject theme CSS at the top of the app
+    inject_theme_css(st.session_state.user_data['night_mode'])
+
     # Check streak on app load
     check_streak()
+    show_friend_notices()
     
     # Sidebar for navigation and user info
     with st.sidebar:
         if not st.session_state.show_profile_edit:
             # Profile box with Streamlit 'Edit' button in top right, not bold
-            st.markdown('''
-            <style>
-            .edit-profile-btn {
-                position: absolute;
-                top: 10px;
-                right: 10px;
-                z-index: 10;
-            }
-            .sidebar-profile { position: relative; }
-            /* Make the Edit button match the Start Learning button */
-            .stButton > button#profile-edit-btn {
-                background-color: #43b77a !important;
-                color: #fff !important;
-                border-radius: 12px !important;
-                font-size: 1.1rem !important;
-                font-weight: bold !important;
-                padding: 0.7rem 2.2rem !important;
-                margin: 0.5rem 0 !important;
-                border: none !important;
-                box-shadow: 0 2px 8px rgba(67,183,122,0.08);
-                transition: background 0.2s;
-            }
-            .stButton > button#profile-edit-btn:hover {
-                background-color: #2e8c5e !important;
-            }
-            /* Make only the Edit button green */
-            .stButton > button[data-testid="baseButton-secondary-profile-edit-btn"] {
-                background-color: #43b77a !important;
-                color: #fff !important;
-                border-radius: 8px !important;
-                border: none !important;
-                font-size: 0.9rem !important;
-                font-weight: normal !important;
-                padding: 2px 14px !important;
-                position: absolute !important;
-                top: 10px !important;
-                right: 10px !important;
-                z-index: 10 !important;
-            }
-            .stButton > button[data-testid="baseButton-secondary-profile-edit-btn"]:hover {
-                background-color: #2e8c5e !important;
-            }
-            </style>
-            ''', unsafe_allow_html=True)
             st.markdown(f'''<div class="sidebar-profile" style="position:relative;">
-                <span class="duo-mascot">{st.session_state.avatar}</span><br>
+                <span class="duo-mascot">{st.session_state.user_data['avatar']}</span><br>
                 <span class="username">{st.session_state.user_data['username'] if st.session_state.user_data['username'] else 'Guest'}</span><br>
                 <span class="level">Level: {st.session_state.user_data['level']}</span><br>
-                <span style="color:#888;font-size:0.95rem;">{st.session_state.account_type} Account</span>
+                <span style="color:#888;font-size:0.95rem;">{st.session_state.user_data['account_type']} Account</span>
             </div>''', unsafe_allow_html=True)
             # Absolutely position the Streamlit button for the edit action
             btn_placeholder = st.empty()
             btn_html = '<div class="edit-profile-btn" style="position:absolute;top:10px;right:10px;z-index:10;width:60px;"></div>'
             st.markdown(btn_html, unsafe_allow_html=True)
-            if btn_placeholder.button("Edit", key="profile-edit-btn", help="Edit Profile"):
-                st.session_state.show_profile_edit = True
+            btn_placeholder.button("Edit", key="profile-edit-btn", help="Edit Profile", on_click=open_profile_editor)
         else:
             st.markdown('<div class="sidebar-profile">', unsafe_allow_html=True)
-            st.markdown(f'<span class="duo-mascot">{st.session_state.avatar}</span>', unsafe_allow_html=True)
-            new_name = st.text_input("Username", value=st.session_state.user_data['username'], key="profile_name_input")
+            st.markdown(f'<span class="duo-mascot">{st.session_state.user_data["avatar"]}</span>', unsafe_allow_html=True)
+            st.text_input("Username", value=st.session_state.user_data['username'], key="profile_name_input")
             avatar_options = ['🦖', '🦁', '🐼', '🐧', '🐸', '🐻', '🐨', '🐰', '🦊', '🐶', '🐱']
             # Avatar select: only enabled if avatar_unlocked
-            if st.session_state.avatar_unlocked:
-                new_avatar = st.selectbox("Avatar", avatar_options, index=avatar_options.index(st.session_state.avatar) if st.session_state.avatar in avatar_options else 0, key="profile_avatar_select")
+            if st.session_state.user_data['avatar_unlocked']:
+                st.selectbox("Avatar", avatar_options, index=avatar_options.index(st.session_state.user_data['avatar']) if st.session_state.user_data['avatar'] in avatar_options else 0, key="profile_avatar_select")
             else:
-                st.selectbox("Avatar (buy 'Custom Avatar' in Rewards to unlock)", avatar_options, index=avatar_options.index(st.session_state.avatar) if st.session_state.avatar in avatar_options else 0, key="profile_avatar_select", disabled=True)
-                new_avatar = st.session_state.avatar
+                st.selectbox("Avatar (buy 'Custom Avatar' in Rewards to unlock)", avatar_options, index=avatar_options.index(st.session_state.user_data['avatar']) if st.session_state.user_data['avatar'] in avatar_options else 0, key="profile_avatar_select", disabled=True)
                 st.info("Buy 'Custom Avatar' in the Rewards shop to unlock more avatars!")
-            new_type = st.selectbox("Account Type", ["Home", "Student", "Teacher"], index=["Home", "Student", "Teacher"].index(st.session_state.account_type), key="profile_type_select")
-            night_mode_toggle = st.checkbox("Night Mode", value=st.session_state.night_mode, key="night_mode_toggle")
+            st.selectbox("Account Type", ["Home", "Student", "Teacher"], index=["Home", "Student", "Teacher"].index(st.session_state.user_data['account_type']), key="profile_type_select")
+            st.checkbox("Night Mode", value=st.session_state.user_data['night_mode'], key="night_mode_toggle")
             col1, col2 = st.columns(2)
             with col1:
-                if st.button("Save", key="profile_save_btn"):
-                    st.session_state.user_data['username'] = new_name
-                    st.session_state.avatar = new_avatar
-                    st.session_state.account_type = new_type
-                    st.session_state.night_mode = night_mode_toggle
-                    st.session_state.show_profile_edit = False
-                    st.rerun()
+                st.button("Save", key="profile_save_btn", on_click=save_profile_edit)
             with col2:
-                if st.button("Cancel", key="profile_cancel_btn"):
-                    st.session_state.show_profile_edit = False
-                    st.rerun()
+                st.button("Cancel", key="profile_cancel_btn", on_click=cancel_profile_edit)
             st.markdown('</div>', unsafe_allow_html=True)
         
+        if st.session_state.username_error:
+            st.warning(st.session_state.username_error)
+            st.session_state.username_error = None
+
         # User profile section
         if st.session_state.user_data['username'] == '':
-            username = st.text_input("Enter your username:")
-            if st.button("Start Learning"):
-                if username.strip():
-                    st.session_state.user_data['username'] = username.strip()
-                    st.rerun()
+            st.text_input("Enter your username:", key="username_input")
+            st.button("Start Learning", on_click=start_learning)
         else:
             st.success(f"Welcome, {st.session_state.user_data['username']}!")
             
@@ -1506,6 +2012,8 @@ def main():
             with col1:
                 st.metric("Level", st.session_state.user_data['level'])
                 st.metric("XP", st.session_state.user_data['xp'])
+                st.caption(f"{get_level_curve().xp_to_next(st.session_state.user_data['xp'])} XP to level "
+                           f"{st.session_state.user_data['level'] + 1}")
             with col2:
                 st.metric("Coins", st.session_state.user_data['coins'])
                 st.metric("Streak", st.session_state.user_data['streak'])
@@ -1516,18 +2024,29 @@ def main():
                 🔥 {st.session_state.user_data['streak']} Day Streak!
             </div>
             """, unsafe_allow_html=True)
+            st.caption(f"Longest streak: {st.session_state.longest_streak} days")
+            if st.session_state.user_data['streak_protectors']:
+                st.caption(f"🛡️ {st.session_state.user_data['streak_protectors']} Streak Protector(s) ready")
+            for effect, ends_at in get_effects().active(st.session_state.user_data['username']).items():
+                st.caption(f"⚡ {effect} active · {format_time_left(ends_at - time.time())}")
             
             # Badges
             if st.session_state.user_data['badges']:
                 st.subheader("Your Badges")
-                for badge in st.session_state.user_data['badges']:
+                for badge in badges.in_display_order(st.session_state.user_data['badges']):
                     st.markdown(f'<span class="badge">{BADGES[badge]["icon"]} {badge}</span>', unsafe_allow_html=True)
         
+        st.session_state.sidebar_stale = False
+
         # Navigation
         st.subheader("Navigation")
         st.markdown("**Choose a page:**")
         page = st.selectbox("", ["🏠 Dashboard", "📚 Lessons", "🏆 Leaderboard", "🎁 Rewards", "👥 Friends"], label_visibility="collapsed")
         st.session_state.page = page
+
+        # Append ?timings to the URL to see the import cost report
+        if "timings" in st.query_params:
+            show_import_timings()
     
     # Main content area
     if page == "🏠 Dashboard":
@@ -1551,9 +2070,10 @@ def show_dashboard():
     
     # Welcome message
     st.success(f"Welcome back, {st.session_state.user_data['username']}! Ready to learn about finance?")
+    show_flash_messages()  # streak notices from check_streak() land on this, the default page
     
     # Progress overview
-    col1, col2, col3 = st.columns(3)
+    col1, col2, col3, col4 = st.columns(4)
     
     with col1:
         st.metric("Lessons Completed", len(st.session_state.user_data['completed_lessons']))
@@ -1564,11 +2084,18 @@ def show_dashboard():
     
     with col3:
         st.metric("Questions Answered", st.session_state.user_data['total_questions'])
+
+    with col4:
+        snapshot = get_leaderboard_snapshots().get(None)
+        percent = snapshot.user_top_percent(st.session_state.user_data['username'])
+        if percent is None:  # guests, and users the snapshot does not have yet
+            percent = snapshot.top_percent(st.session_state.user_data['xp'])
+        st.metric("XP Ranking", f"Top {format_top_percent(percent)}")
     
     # Recent activity
     st.subheader("Recent Activity")
     if st.session_state.user_data['completed_lessons']:
-        for lesson in st.session_state.user_data['completed_lessons'][-3:]:
+        for lesson in list(st.session_state.user_data['completed_lessons'])[-3:]:
             st.info(f"✅ Completed: {lesson}")
     else:
         st.info("No lessons completed yet. Start your first lesson!")
@@ -1589,6 +2116,8 @@ def show_lessons():
     if st.session_state.user_data['username'] == '':
         st.warning("Please enter your username first!")
         return
+
+    show_flash_messages()
     
     # Show all lessons but indicate which ones are locked
     lesson_names = list(LESSONS_DATA.keys())
@@ -1600,7 +2129,7 @@ def show_lessons():
                 is_available = True
             else:
                 prev_lesson = lesson_names[idx-1]
-                if prev_lesson in st.session_state.perfect_lessons:
+                if prev_lesson in st.session_state.user_data['perfect_lessons']:
                     is_available = True
             # Allow replay if completed
             can_replay = lesson_name in st.session_state.user_data['completed_lessons']
@@ -1625,21 +2154,9 @@ def show_lessons():
                 if lesson_name in st.session_state.user_data['completed_lessons']:
                     st.success("✅ Completed!")
                     # Allow replay
-                    if st.button(f"Replay {lesson_name}", key=f"replay_{lesson_name}"):
-                        st.session_state.current_lesson = lesson_name
-                        st.session_state.question_index = 0
-                        st.session_state.lesson_completed = False
-                        st.session_state.show_answer = False
-                        st.session_state.selected_answer = None
-                        st.rerun()
+                    st.button(f"Replay {lesson_name}", key=f"replay_{lesson_name}", on_click=open_lesson, args=(lesson_name,))
                 elif is_available:
-                    if st.button(f"Start {lesson_name}", key=f"start_{lesson_name}"):
-                        st.session_state.current_lesson = lesson_name
-                        st.session_state.question_index = 0
-                        st.session_state.lesson_completed = False
-                        st.session_state.show_answer = False
-                        st.session_state.selected_answer = None
-                        st.rerun()
+                    st.button(f"Start {lesson_name}", key=f"start_{lesson_name}", on_click=open_lesson, args=(lesson_name,))
                 else:
                     st.info(f"🔒 Requires perfect completion of previous lesson")
             with col2:
@@ -1650,26 +2167,9 @@ def show_current_lesson():
     lesson_name = st.session_state.current_lesson
     lesson_data = LESSONS_DATA[lesson_name]
     # Add a green, functional back button
-    back_btn_style = "background:#43b77a;color:#fff;font-weight:bold;font-size:1.1rem;padding:0.5rem 1.5rem;border-radius:10px;border:none;cursor:pointer;"
-    back_btn_html = f'<style>div[data-testid="stButton"] button{{{back_btn_style}}}</style>'
-    st.markdown(back_btn_html, unsafe_allow_html=True)
-    if st.button("\u2190 Back to Lessons", key="back_to_lessons", help="Return to lesson list"):
-        st.session_state.current_lesson = None
-        st.session_state.question_index = 0
-        st.session_state.lesson_completed = False
-        st.session_state.show_answer = False
-        st.session_state.selected_answer = None
-        st.session_state.last_answer_correct = False
-        st.rerun()
+    st.button("\u2190 Back to Lessons", key="back_to_lessons", help="Return to lesson list", on_click=close_lesson)
     st.title(f"📚 {lesson_name}")
     st.markdown(f"**Level {lesson_data['level']}** - {lesson_data['description']}")
-    # Progress dots for quiz
-    if st.session_state.question_index > 0:
-        total_q = len(lesson_data['questions'])
-        st.markdown('<div class="duo-progress">' + ''.join([
-            f'<span class="duo-dot {"active" if i+1==st.session_state.question_index else ("completed" if i+1<st.session_state.question_index else "")}"></span>'
-            for i in range(total_q)
-        ]) + '</div>', unsafe_allow_html=True)
     # Show lesson content
     if st.session_state.question_index == 0:
         st.markdown("---")
@@ -1680,147 +2180,142 @@ def show_current_lesson():
         st.info("Take your time to read through the lesson content above. When you're ready, click the button below to start the quiz!")
         col1, col2, col3 = st.columns([1, 2, 1])
         with col2:
-            if st.button("🚀 Start Quiz", key="start_quiz_btn"):
-                st.session_state.question_index = 1
-                st.session_state.show_answer = False
-                st.session_state.selected_answer = None
-                st.rerun()
-    elif st.session_state.question_index <= len(lesson_data['questions']):
-        question_data = lesson_data['questions'][st.session_state.question_index - 1]
+            st.button("🚀 Start Quiz", key="start_quiz_btn", on_click=start_quiz)
+    else:
+        quiz_panel(lesson_name)
+
+@st.fragment
+def quiz_panel(lesson_name):
+    """Question card, answer choices and feedback; reruns on its own between questions"""
+    # Callbacks only rerun this panel; hand over to a full run when the
+    # sidebar is out of date or the lesson was closed
+    if st.session_state.sidebar_stale or st.session_state.current_lesson != lesson_name:
+        st.rerun()
+    lesson_data = LESSONS_DATA[lesson_name]
+    # Progress dots for quiz
+    total_q = len(lesson_data['questions'])
+    st.markdown('<div class="duo-progress">' + ''.join([
+        f'<span class="duo-dot {"active" if i+1==st.session_state.question_index else ("completed" if i+1<st.session_state.question_index else "")}"></span>'
+        for i in range(total_q)
+    ]) + '</div>', unsafe_allow_html=True)
+    question_data = lesson_data['questions'][st.session_state.question_index - 1]
+    st.markdown("---")
+    st.subheader(f"Question {st.session_state.question_index} of {len(lesson_data['questions'])}")
+    st.markdown(f"""
+    <div class="question-card">
+        <h3 style="color: #000000; margin-bottom: 15px;">{question_data['question']}</h3>
+    </div>
+    """, unsafe_allow_html=True)
+    st.subheader("Select your answer:")
+    radio_key = f"q{st.session_state.question_index}_radio"
+    st.radio("Choose your answer:", question_data['options'], key=radio_key)
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col2:
+        st.button("Submit Answer", key=f"submit_{st.session_state.question_index}", on_click=submit_answer, args=(lesson_name,))
+    show_flash_messages()
+    if st.session_state.show_answer:
+        correct_answer = question_data['options'][question_data['correct']]
+        if st.session_state.last_answer_correct:
+            st.success("✅ Correct!")
+            st.markdown(f"""
+            <div style="background-color: #d4edda; border: 1px solid #c3e6cb; border-radius: 8px; padding: 15px; margin: 15px 0;">
+                <h4 style="color: #155724; margin: 0;">Explanation:</h4>
+                <p style="color: #155724; margin: 10px 0 0 0;">{question_data['explanation']}</p>
+            </div>
+            """, unsafe_allow_html=True)
+        else:
+            st.error(f"❌ Incorrect. The correct answer is: {correct_answer}")
+            st.markdown(f"""
+            <div style="background-color: #f8d7da; border: 1px solid #f5c6cb; border-radius: 8px; padding: 15px; margin: 15px 0;">
+                <h4 style="color: #721c24; margin: 0;">Explanation:</h4>
+                <p style="color: #721c24; margin: 10px 0 0 0;">{question_data['explanation']}</p>
+            </div>
+            """, unsafe_allow_html=True)
         st.markdown("---")
-        st.subheader(f"Question {st.session_state.question_index} of {len(lesson_data['questions'])}")
-        st.markdown(f"""
-        <div class="question-card">
-            <h3 style="color: #000000; margin-bottom: 15px;">{question_data['question']}</h3>
-        </div>
-        """, unsafe_allow_html=True)
-        st.subheader("Select your answer:")
-        radio_key = f"q{st.session_state.question_index}_radio"
-        selected_answer = st.radio("Choose your answer:", question_data['options'], key=radio_key)
-        if 'selected_answer' not in st.session_state or st.session_state.selected_answer is None:
-            st.session_state.selected_answer = None
-        col1, col2, col3 = st.columns([1, 2, 1])
-        with col2:
-            if st.button("Submit Answer", key=f"submit_{st.session_state.question_index}") and not st.session_state.show_answer:
-                st.session_state.selected_answer = selected_answer
-                correct_answer = question_data['options'][question_data['correct']]
-                st.session_state.last_answer_correct = (selected_answer == correct_answer)
-                st.session_state.show_answer = True
-                st.session_state.user_data['total_questions'] += 1
-                if st.session_state.last_answer_correct:
-                    st.session_state.user_data['correct_answers'] += 1
-                    st.session_state.user_data['xp'] += 20
-                    st.session_state.user_data['coins'] += 10
-                    recalculate_level()
-                new_badges = check_badges()
-                if new_badges:
-                    st.balloons()
-                    st.success(f"🎉 New badge earned: {', '.join(new_badges)}")
-                st.rerun()
-        if st.session_state.show_answer:
-            correct_answer = question_data['options'][question_data['correct']]
-            if st.session_state.last_answer_correct:
-                st.success("✅ Correct!")
-                st.markdown(f"""
-                <div style="background-color: #d4edda; border: 1px solid #c3e6cb; border-radius: 8px; padding: 15px; margin: 15px 0;">
-                    <h4 style="color: #155724; margin: 0;">Explanation:</h4>
-                    <p style="color: #155724; margin: 10px 0 0 0;">{question_data['explanation']}</p>
-                </div>
-                """, unsafe_allow_html=True)
-            else:
-                st.error(f"❌ Incorrect. The correct answer is: {correct_answer}")
-                st.markdown(f"""
-                <div style="background-color: #f8d7da; border: 1px solid #f5c6cb; border-radius: 8px; padding: 15px; margin: 15px 0;">
-                    <h4 style="color: #721c24; margin: 0;">Explanation:</h4>
-                    <p style="color: #721c24; margin: 10px 0 0 0;">{question_data['explanation']}</p>
-                </div>
-                """, unsafe_allow_html=True)
-            st.markdown("---")
-            if st.session_state.question_index < len(lesson_data['questions']):
-                col1, col2, col3 = st.columns([1, 2, 1])
-                with col2:
-                    if st.button("Next Question", key=f"next_{st.session_state.question_index}"):
-                        st.session_state.question_index += 1
-                        st.session_state.show_answer = False
-                        st.session_state.selected_answer = None
-                        st.rerun()
-            else:
-                st.session_state.lesson_completed = True
-                st.session_state.user_data['completed_lessons'].append(lesson_name)
-                st.session_state.user_data['xp'] += 100  # Bonus for completing lesson
-                st.session_state.user_data['coins'] += 50
-                recalculate_level()
-                num_questions = len(lesson_data['questions'])
-                correct_in_lesson = 0
-                if st.session_state.user_data['correct_answers'] >= num_questions and st.session_state.user_data['total_questions'] >= num_questions:
-                    if lesson_name not in st.session_state.perfect_lessons:
-                        st.session_state.perfect_lessons.append(lesson_name)
-                if st.session_state.user_data['correct_answers'] == len(lesson_data['questions']):
-                    if "Perfect Score" not in st.session_state.user_data['badges']:
-                        st.session_state.user_data['badges'].append("Perfect Score")
-                        st.success("🎉 Perfect Score! You earned the Perfect Score badge!")
-                st.success("🎉 Lesson completed! Great job!")
-                st.metric("XP Earned", "+100")
-                st.metric("Coins Earned", "+50")
-                col1, col2, col3 = st.columns([1, 2, 1])
-                with col2:
-                    if st.button("Continue to Next Lesson", key="continue_next_lesson"):
-                        st.session_state.current_lesson = None
-                        st.session_state.question_index = 0
-                        st.session_state.lesson_completed = False
-                        st.session_state.show_answer = False
-                        st.session_state.selected_answer = None
-                        st.rerun()
+        if quiz_state() == FEEDBACK:
+            col1, col2, col3 = st.columns([1, 2, 1])
+            with col2:
+                st.button("Next Question", key=f"next_{st.session_state.question_index}", on_click=next_question)
+        else:
+            st.success("🎉 Lesson completed! Great job!")
+            st.metric("XP Earned", f"+{st.session_state.completion_xp}")
+            st.metric("Coins Earned", "+50")
+            col1, col2, col3 = st.columns([1, 2, 1])
+            with col2:
+                st.button("Continue to Next Lesson", key="continue_next_lesson", on_click=close_lesson)
+
+def format_top_percent(percent):
+    return f"{percent:.0f}%" if percent >= 1 else f"{percent:.2g}%"
+
+def format_age(seconds):
+    if seconds < 1:
+        return "just now"
+    if seconds < 60:
+        return f"{int(seconds)}s ago"
+    if seconds < 3600:
+        return f"{int(seconds // 60)} min ago"
+    if seconds < 86400:
+        return f"{int(seconds // 3600)} h ago"
+    return f"{int(seconds // 86400)} d ago"
+
+def format_time_left(seconds):
+    if seconds < 3600:
+        return f"{max(int(seconds // 60), 1)} min left"
+    return f"{int(seconds // 3600)} h {int(seconds % 3600 // 60)} min left"
+
+def leaderboard_table(rows, username):
+    """Ranked rows as a table ready to display, with the user's row marked"""
+    df = pd.DataFrame(rows, columns=LEADERBOARD_COLUMNS).set_index('rank')
+    df.loc[df['username'].eq(username).to_numpy(), 'username'] = LEADERBOARD_YOU.format(username)
+    return df
+
+def show_leaderboard_table(view, version, load_rows):
+    """Render a leaderboard view, rebuilding its table only when its version changes
+
+    The cached DataFrame already holds the display values, so a rerun only
+    serializes it.
+    """
+    username = st.session_state.user_data['username']
+    cache = st.session_state.setdefault('leaderboard_tables', {})
+    key = (version, username)
+    if view not in cache or cache[view][0] != key:
+        cache[view] = (key, leaderboard_table(load_rows(), username))
+    st.dataframe(cache[view][1], use_container_width=True)
 
 def show_leaderboard():
     """Display the leaderboard"""
     st.title("🏆 Leaderboard")
+    show_flash_messages()
 
     leaderboard_type = st.radio("Leaderboard Type", ["Worldwide Leaderboard", "Friends Leaderboard"], horizontal=True)
+    user_data = st.session_state.user_data
 
     if leaderboard_type == "Worldwide Leaderboard":
-        # Add current user to leaderboard
-        leaderboard = LEADERBOARD_DATA.copy()
-        if st.session_state.user_data['username']:
-            leaderboard.append({
-                "username": st.session_state.user_data['username'],
-                "xp": st.session_state.user_data['xp'],
-                "level": st.session_state.user_data['level'],
-                "streak": st.session_state.user_data['streak']
-            })
-        # Sort by XP
-        leaderboard.sort(key=lambda x: x['xp'], reverse=True)
-        # Create DataFrame for display
-        df = pd.DataFrame(leaderboard)
-        # Highlight current user
-        def highlight_user(row):
-            if row['username'] == st.session_state.user_data['username']:
-                return ['background-color: yellow'] * len(row)
-            return [''] * len(row)
-        st.dataframe(df.style.apply(highlight_user, axis=1), use_container_width=True)
+        period = st.radio("Period", list(LEADERBOARD_PERIODS), horizontal=True)
+        window = LEADERBOARD_PERIODS[period]
+        snapshot = get_leaderboard_snapshots().get(window)
+        rank = snapshot.rank(user_data['username'])
+        if rank:
+            top = format_top_percent(snapshot.user_top_percent(user_data['username']))
+            st.markdown(f"**Your rank: #{rank} of {len(snapshot)}** · you are in the top {top}")
+        elif window is not None:
+            st.info("Earn XP in this period to get on this leaderboard!")
+        st.caption(f"Updated {format_age(snapshot.age())}")
+
+        # Only the top rows and the rows around the user are fetched, however big the board gets
+        def load_rows():
+            window_rows = snapshot.window(user_data['username'], LEADERBOARD_TOP, LEADERBOARD_AROUND)
+            return window_rows['top'] + window_rows['around']
+        show_leaderboard_table(f"worldwide-{window}", (snapshot.period, snapshot.version), load_rows)
     else:
-        # Friends leaderboard (user + Andy, Brian, Kaan, Elisa)
-        friends = [
-            {"username": "Andy", "xp": 1200, "level": 3, "streak": 5},
-            {"username": "Brian", "xp": 950, "level": 2, "streak": 3},
-            {"username": "Kaan", "xp": 800, "level": 2, "streak": 2},
-            {"username": "Elisa", "xp": 700, "level": 1, "streak": 1}
-        ]
-        if st.session_state.user_data['username']:
-            friends.append({
-                "username": st.session_state.user_data['username'],
-                "xp": st.session_state.user_data['xp'],
-                "level": st.session_state.user_data['level'],
-                "streak": st.session_state.user_data['streak']
-            })
-        # Sort by XP
-        friends.sort(key=lambda x: x['xp'], reverse=True)
-        df = pd.DataFrame(friends)
-        def highlight_user(row):
-            if row['username'] == st.session_state.user_data['username']:
-                return ['background-color: yellow'] * len(row)
-            return [''] * len(row)
-        st.dataframe(df.style.apply(highlight_user, axis=1), use_container_width=True)
+        if not user_data['username']:
+            st.info("Enter your username in the sidebar to see how you compare with your friends!")
+            return
+        # Cached per user until they or one of their friends changes
+        version, rows = get_friend_rankings().rankings(user_data['username'])
+        if len(rows) < 2:
+            st.info("Add friends on the Friends page to compare your XP with theirs!")
+        show_leaderboard_table("friends", version, lambda: rows)
 
 def show_rewards():
     """Display rewards and shop"""
@@ -1830,6 +2325,8 @@ def show_rewards():
         st.warning("Please enter your username first!")
         return
     
+    show_flash_messages()
+
     # Available badges
     st.subheader("🏆 Available Badges")
     st.markdown("Complete challenges to earn these badges:")
@@ -1852,7 +2349,7 @@ def show_rewards():
                 <div style="background-color: #f8f9fa; border: 2px solid #6c757d; border-radius: 10px; padding: 15px; margin: 10px 0;">
                     <h4 style="color: #6c757d; margin: 0;">{badge_info['icon']} {badge_name}</h4>
                     <p style="color: #6c757d; margin: 5px 0;">{badge_info['requirement']}</p>
-                    <p style="color: #6c757d; font-weight: bold; margin: 0;">🔒 LOCKED</p>
+                    <p style="color: #6c757d; font-weight: bold; margin: 0;">🔒 LOCKED · {badges.progress_label(badge_name, badge_progress(badge_info['counter']))}</p>
                 </div>
                 """, unsafe_allow_html=True)
     
@@ -1870,6 +2367,7 @@ def show_rewards():
     }
     
     st.markdown("### Available Items:")
+    active_effects = get_effects().active(st.session_state.user_data['username'])
     
     for item_name, item_info in shop_items.items():
         st.markdown(f"""
@@ -1890,69 +2388,82 @@ def show_rewards():
         with col1:
             pass  # Space for layout
         with col2:
-            if item_name == "Custom Avatar" and st.session_state.avatar_unlocked:
+            if item_name in active_effects:  # buying it again extends it
+                st.caption(f"Active · {format_time_left(active_effects[item_name] - time.time())}")
+            if item_name == "Custom Avatar" and st.session_state.user_data['avatar_unlocked']:
                 st.success("Unlocked!")
             elif st.session_state.user_data['coins'] >= item_info['price']:
-                if st.button(f"Buy {item_name}", key=f"buy_{item_name}"):
-                    st.session_state.user_data['coins'] -= item_info['price']
-                    st.success(f"🎉 Purchased {item_name}!")
-                    if item_name == "Custom Avatar":
-                        st.session_state.avatar_unlocked = True
-                    st.rerun()
+                st.button(f"Buy {item_name}", key=f"buy_{item_name}", on_click=buy_item, args=(item_name, item_info['price']))
             else:
                                  st.info(f"Need {item_info['price'] - st.session_state.user_data['coins']} more coins")
 
 def show_friends():
     st.title("👥 Friends")
-    # Friends system state
-    if 'friends' not in st.session_state:
-        st.session_state.friends = []
-    if 'friend_requests_sent' not in st.session_state:
-        st.session_state.friend_requests_sent = []
-    if 'friend_requests_received' not in st.session_state:
-        st.session_state.friend_requests_received = []
+    show_flash_messages()
+    graph = get_friend_graph()
+    username = st.session_state.user_data['username']
 
     with st.expander("Add a Friend", expanded=True):
-        friend_username = st.text_input("Enter username to add as friend:", key="add_friend_input_main")
-        if st.button("Send Friend Request", key="send_friend_request_btn_main"):
-            if friend_username and friend_username != st.session_state.user_data['username']:
-                if friend_username not in st.session_state.friend_requests_sent and friend_username not in st.session_state.friends:
-                    st.session_state.friend_requests_sent.append(friend_username)
-                    st.success(f"Friend request sent to {friend_username}!")
-                else:
-                    st.info("Already sent or already friends.")
-            else:
-                st.warning("Enter a valid username (not your own).")
+        query = st.text_input("Enter username to add as friend:", key="add_friend_input_main").strip()
+        suggestions = [name for name in get_username_index().complete(query, FRIEND_SUGGESTIONS)
+                       if name != username and name != query]
+        if suggestions:
+            st.caption("Did you mean:")
+            cols = st.columns(len(suggestions))
+            for col, name in zip(cols, suggestions):
+                with col:
+                    st.button(name, key=f"friend_suggestion_{name}", on_click=pick_friend_suggestion, args=(name,))
+        st.button("Send Friend Request", key="send_friend_request_btn_main", on_click=send_friend_request)
 
     # Display current friends
-    if st.session_state.friends:
+    friends = graph.friends(username)
+    if friends:
         st.markdown("**Your Friends:**")
-        for f in st.session_state.friends:
+        for f in friends:
             st.markdown(f"- {f}")
     else:
         st.info("No friends yet. Add some!")
 
+    # People you may know; lists are precomputed, so only drop anyone added since
+    taken = set(friends) | set(graph.sent(username)) | set(graph.received(username))
+    suggestions = [s for s in get_friend_suggestions().get(username) if s[0] not in taken]
+    if suggestions:
+        st.markdown("**People You May Know:**")
+        for name, mutual, shared in suggestions:
+            col1, col2 = st.columns([2,1])
+            with col1:
+                details = f"{mutual} mutual friend{'s' if mutual != 1 else ''}"
+                if shared:
+                    details += f" · {shared} lesson{'s' if shared != 1 else ''} in common"
+                st.markdown(f"- {name} ({details})")
+            with col2:
+                st.button(f"Add {name}", key=f"suggest_{name}_main", on_click=request_friend, args=(name,))
+
+    # Friend activity feed
+    activity = get_activity_feed().read(username, FEED_ENTRIES_SHOWN)
+    if activity:
+        st.markdown("**Friend Activity:**")
+        for posted_at, friend, message in activity:
+            st.markdown(f"- **{friend}** {message} · {format_age(time.time() - posted_at)}")
+
     # Display sent requests
-    if st.session_state.friend_requests_sent:
+    sent = graph.sent(username)
+    if sent:
         st.markdown("**Sent Friend Requests:**")
-        for f in st.session_state.friend_requests_sent:
+        for f in sent:
             st.markdown(f"- {f} (pending)")
 
-    # Display received requests (simulate for demo)
-    if st.session_state.friend_requests_received:
+    # Display received requests
+    received = graph.received(username)
+    if received:
         st.markdown("**Received Friend Requests:**")
-        for f in st.session_state.friend_requests_received:
+        for f in received:
             col1, col2 = st.columns([2,1])
             with col1:
                 st.markdown(f"- {f}")
             with col2:
-                if st.button(f"Accept {f}", key=f"accept_{f}_main"):
-                    st.session_state.friends.append(f)
-                    st.session_state.friend_requests_received.remove(f)
-                    st.success(f"You are now friends with {f}!")
-                if st.button(f"Decline {f}", key=f"decline_{f}_main"):
-                    st.session_state.friend_requests_received.remove(f)
-                    st.info(f"Declined friend request from {f}.")
+                st.button(f"Accept {f}", key=f"accept_{f}_main", on_click=accept_friend, args=(f,))
+                st.button(f"Decline {f}", key=f"decline_{f}_main", on_click=decline_friend, args=(f,))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,207 @@
+"""Process-wide friend graph for the Finasaur app.
+
+Friendships are adjacency sets and pending requests are indexed both by
+sender and by recipient, so every check, accept and decline is O(1). The
+graph is shared by all sessions: a request shows up on the recipient's
+Friends page, and as a notice on their next rerun, without them having to
+reload anything. FriendRankings builds each user's friends leaderboard
+from the graph, and ActivityFeed fans each user's news out to their friends.
+"""
+import itertools
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Set
+
+MAX_NOTICES = 20  # per user, oldest dropped first
+FEED_SIZE = 50  # activity entries kept per user, oldest dropped first
+
+# send_request() outcomes
+SENT = "sent"
+ACCEPTED = "accepted"  # the other user had already asked, so they are now friends
+ALREADY_FRIENDS = "already_friends"
+ALREADY_SENT = "already_sent"
+
+
+class FriendGraph:
+    """Friendships and pending friend requests between usernames"""
+
+    def __init__(self, friendships=(), requests=()):
+        self._lock = threading.Lock()
+        self._friends: Dict[str, Set[str]] = {}
+        # Pending requests, one index per direction; dicts keep arrival order
+        self._sent: Dict[str, Dict[str, None]] = {}
+        self._received: Dict[str, Dict[str, None]] = {}
+        self._notices: Dict[str, deque] = {}
+        for username, friend in friendships:
+            self._link(username, friend)
+        for sender, recipient in requests:
+            self._sent.setdefault(sender, {})[recipient] = None
+            self._received.setdefault(recipient, {})[sender] = None
+
+    def _link(self, a, b):
+        self._friends.setdefault(a, set()).add(b)
+        self._friends.setdefault(b, set()).add(a)
+
+    def _drop_request(self, sender, recipient):
+        self._sent.get(sender, {}).pop(recipient, None)
+        self._received.get(recipient, {}).pop(sender, None)
+
+    def _notify(self, username, message):
+        self._notices.setdefault(username, deque(maxlen=MAX_NOTICES)).append(message)
+
+    def send_request(self, sender, recipient) -> str:
+        with self._lock:
+            if recipient in self._friends.get(sender, ()):
+                return ALREADY_FRIENDS
+            if recipient in self._sent.get(sender, {}):
+                return ALREADY_SENT
+            if recipient in self._received.get(sender, {}):
+                self._drop_request(recipient, sender)
+                self._link(sender, recipient)
+                self._notify(recipient, f"🤝 {sender} accepted your friend request!")
+                return ACCEPTED
+            self._sent.setdefault(sender, {})[recipient] = None
+            self._received.setdefault(recipient, {})[sender] = None
+            self._notify(recipient, f"📨 New friend request from {sender}")
+            return SENT
+
+    def accept(self, username, requester) -> bool:
+        """Accept requester's pending request; returns False if there was none"""
+        with self._lock:
+            if requester not in self._received.get(username, {}):
+                return False
+            self._drop_request(requester, username)
+            self._link(username, requester)
+            self._notify(requester, f"🤝 {username} accepted your friend request!")
+            return True
+
+    def decline(self, username, requester) -> bool:
+        with self._lock:
+            if requester not in self._received.get(username, {}):
+                return False
+            self._drop_request(requester, username)
+            return True
+
+    def friends(self, username) -> List[str]:
+        with self._lock:
+            return sorted(self._friends.get(username, ()))
+
+    def edges(self) -> List[tuple]:
+        """Every friendship once, as a (username, friend) pair"""
+        with self._lock:
+            return [(username, friend) for username, friends in self._friends.items()
+                    for friend in friends if username < friend]
+
+    def sent(self, username) -> List[str]:
+        with self._lock:
+            return list(self._sent.get(username, {}))
+
+    def received(self, username) -> List[str]:
+        with self._lock:
+            return list(self._received.get(username, {}))
+
+    def take_notices(self, username) -> List[str]:
+        """Hand over and forget the notices waiting for username"""
+        with self._lock:
+            notices = self._notices.pop(username, None)
+            return list(notices) if notices else []
+
+    def rename(self, old_username, new_username):
+        with self._lock:
+            friends = self._friends.pop(old_username, set())
+            for friend in friends:
+                self._friends[friend].discard(old_username)
+                self._friends[friend].add(new_username)
+            if friends:
+                self._friends[new_username] = friends
+            sent = self._sent.pop(old_username, {})
+            for recipient in sent:
+                received = self._received[recipient]
+                self._received[recipient] = {new_username if name == old_username else name: None
+                                             for name in received}
+            if sent:
+                self._sent[new_username] = sent
+            received = self._received.pop(old_username, {})
+            for sender in received:
+                self._sent[sender].pop(old_username)
+                self._sent[sender][new_username] = None
+            if received:
+                self._received[new_username] = received
+            if old_username in self._notices:
+                self._notices[new_username] = self._notices.pop(old_username)
+
+
+class FriendRankings:
+    """Per-user friends leaderboards, cached until the user or a friend changes
+
+    Each user's board is built from one batched read of the shared
+    leaderboard and kept until invalidate() is called for that user or one
+    of their friends.
+    """
+
+    def __init__(self, graph, leaderboard):
+        self.graph = graph
+        self.leaderboard = leaderboard
+        self._lock = threading.Lock()
+        self._cache: Dict[str, tuple] = {}  # username -> (version, ranked rows)
+        self._versions = itertools.count(1)
+        self._generation = 0  # bumped by every invalidate()
+
+    def rankings(self, username):
+        """(version, rows ranked by XP) for username and their friends"""
+        with self._lock:
+            cached = self._cache.get(username)
+            generation = self._generation
+        if cached is not None:
+            return cached
+        rows = self.leaderboard.get_many(self.graph.friends(username) + [username])
+        rows.sort(key=lambda row: (-row['xp'], row['username']))
+        result = (next(self._versions), [dict(row, rank=rank) for rank, row in enumerate(rows, 1)])
+        with self._lock:
+            if generation == self._generation:  # nothing went stale while we read
+                self._cache[username] = result
+        return result
+
+    def invalidate(self, username):
+        """Drop the cached boards that show username: their own and their friends'"""
+        friends = self.graph.friends(username)
+        with self._lock:
+            self._generation += 1
+            self._cache.pop(username, None)
+            for friend in friends:
+                self._cache.pop(friend, None)
+
+
+class ActivityFeed:
+    """What each user's friends have been up to, newest first
+
+    Posting copies the entry into a fixed-size ring buffer per friend (fan
+    out on write), so reading a feed only touches that feed and memory per
+    user never grows past FEED_SIZE entries. Feeds live in memory only.
+    """
+
+    def __init__(self, graph, size=FEED_SIZE):
+        self.graph = graph
+        self.size = size
+        self._lock = threading.Lock()
+        self._feeds: Dict[str, deque] = {}
+
+    def post(self, username, message):
+        entry = (time.time(), username, message)
+        friends = self.graph.friends(username)
+        with self._lock:
+            for friend in friends:
+                feed = self._feeds.get(friend)
+                if feed is None:
+                    feed = self._feeds[friend] = deque(maxlen=self.size)
+                feed.append(entry)
+
+    def read(self, username, limit=None) -> List[tuple]:
+        """(timestamp, friend, message) entries, newest first"""
+        with self._lock:
+            feed = self._feeds.get(username)
+            if not feed:
+                return []
+            entries = list(reversed(feed))
+        return entries[:limit] if limit else entries
@@ -0,0 +1,198 @@
+"""Write-behind event journal for profile updates.
+
+Clicks only append an event to an in-memory queue. A single background
+thread drains the queue in batches, appends the batch to the journal file
+with one fsync (group commit), and then applies it to the profile store in
+one transaction. Events carry absolute values rather than deltas, so
+replaying the journal after a crash is idempotent: whatever the store
+already holds, replaying it again yields the same profiles.
+
+Events name the profile by its token, which never changes, as well as by
+username. An event the store rejects is set aside in a ``.rejected`` file
+next to the journal instead of holding up the events queued after it.
+"""
+import atexit
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOURNAL_PATH = os.environ.get(
+    "FINIQ_JOURNAL_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "finasaur.events"),
+)
+
+# Event types
+ANSWER = "a"   # v = [total_questions, correct_answers, xp, coins, level, badge_progress]
+PROFILE = "p"  # v = full profile dict
+XP = "x"       # v = [day (ISO date), XP earned that day so far]
+FRIEND = "f"   # v = [action ("request", "accept" or "decline"), other username]
+# Every event also has "u", the username when it was queued, and "k", the
+# profile token; journals written before tokens were added only have "u".
+
+
+def answer_event(token, username, total_questions, correct_answers, xp, coins, level, badge_progress):
+    return {"t": ANSWER, "k": token, "u": username,
+            "v": [total_questions, correct_answers, xp, coins, level, dict(badge_progress)]}
+
+
+def profile_event(profile):
+    return {"t": PROFILE, "k": profile['token'], "u": profile['username'], "v": profile}
+
+
+def xp_event(token, username, day, daily_xp):
+    return {"t": XP, "k": token, "u": username, "v": [day.isoformat(), daily_xp]}
+
+
+def friend_event(token, username, action, other_username):
+    return {"t": FRIEND, "k": token, "u": username, "v": [action, other_username]}
+
+
+def read_journal(path) -> List[dict]:
+    """Read every complete event from a journal file, in order"""
+    events = []
+    if not os.path.exists(path):
+        return events
+    with open(path, 'r', encoding='utf-8') as journal_file:
+        for line in journal_file:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                break  # torn final write from a crash; nothing after it was acknowledged
+    return events
+
+
+def set_aside(path, rejected):
+    """Append events the store rejected to path + ".rejected", for someone to look at"""
+    logger.error("Setting aside %d journal events the store rejected", len(rejected))
+    with open(path + ".rejected", 'a', encoding='utf-8') as rejected_file:
+        rejected_file.write(''.join(json.dumps(event, separators=(',', ':')) + '\n' for event in rejected))
+
+
+def replay_pending(path, apply_batch) -> List[dict]:
+    """Apply whatever a journal file still holds, then empty it; returns the events
+
+    apply_batch returns the events it could not apply, which are set aside.
+    """
+    pending = read_journal(path)
+    if pending:
+        rejected = apply_batch(pending)
+        if rejected:
+            set_aside(path, rejected)
+        open(path, 'w').close()
+    return pending
+
+
+class EventJournal:
+    """Queues profile events and writes them behind the request path"""
+
+    def __init__(self, path, apply_batch, batch_size=512, flush_interval=0.05, checkpoint_bytes=1 << 20):
+        """apply_batch writes events to the store and returns those it rejected"""
+        self.path = path
+        self.apply_batch = apply_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.checkpoint_bytes = checkpoint_bytes
+        self._queue = queue.Queue()
+        self._applied_seq = 0
+        self._checkpoint_seq = 0  # the last sync whose checkpoint emptied the file
+        self._unapplied = []  # journaled events from batches the store failed to take
+        self._applied = threading.Condition()
+        self._stopping = threading.Event()
+
+        # Recover anything that was journaled but not yet applied before a restart
+        pending = replay_pending(path, apply_batch)
+        self._seq = itertools.count(max((event['s'] for event in pending), default=0) + 1)
+        self._file = open(path, 'w', encoding='utf-8')  # everything in it is applied now
+        self._thread = threading.Thread(target=self._run, name="finiq-journal-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def append(self, event) -> int:
+        """Queue an event without touching disk; returns its sequence number"""
+        event['s'] = next(self._seq)
+        self._queue.put(event)
+        return event['s']
+
+    def sync(self, timeout=5.0, checkpoint=False) -> bool:
+        """Block until everything queued so far has been written and applied
+
+        With checkpoint, the journal file is also emptied once it is all
+        applied. Do that before writing to the store directly (renaming or
+        creating a profile): replaying events from before such a write on the
+        next start would undo it. Returns False on timeout, or when the
+        checkpoint was skipped because the store could not take every event.
+        """
+        target = self.append({"t": "sync", "checkpoint": checkpoint})
+        with self._applied:
+            if not self._applied.wait_for(lambda: self._applied_seq >= target, timeout):
+                return False
+            return not checkpoint or self._checkpoint_seq >= target
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        events = [event for event in batch if event['t'] != "sync"]
+        if events:
+            self._file.write(''.join(json.dumps(event, separators=(',', ':')) + '\n' for event in events))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        if events or self._unapplied:
+            self._apply(self._unapplied + events)
+        checkpoints = [event['s'] for event in batch if event.get('checkpoint')]
+        checkpointed = False
+        if checkpoints or self._file.tell() >= self.checkpoint_bytes:
+            checkpointed = self._checkpoint()
+        with self._applied:
+            self._applied_seq = max(self._applied_seq, max(event['s'] for event in batch))
+            if checkpointed and checkpoints:
+                self._checkpoint_seq = max(checkpoints)
+            self._applied.notify_all()
+
+    def _apply(self, events):
+        try:
+            rejected = self.apply_batch(events)
+        except Exception:
+            # The events are safely journaled; they are tried again with the next batch
+            self._unapplied = events
+            logger.exception("Failed to apply %d journal events", len(events))
+            return
+        self._unapplied = []
+        if rejected:
+            set_aside(self.path, rejected)
+
+    def _checkpoint(self) -> bool:
+        # Only truncate once everything in the file is known to be in the store
+        if self._unapplied:
+            return False
+        self._file.seek(0)
+        self._file.truncate()
+        return True
+
+    def close(self):
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._file.close()
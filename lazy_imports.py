@@ -0,0 +1,71 @@
+"""Lazy module loading and import timing for the Finasaur app.
+
+Streamlit re-executes finasaur.py on every rerun, but modules stay cached in
+``sys.modules`` for the life of the server process. Heavy libraries are
+wrapped in ``LazyModule`` so they are only imported the first time a page
+actually touches them, and every first import is timed so the cost can be
+reported.
+"""
+import importlib
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+# module name -> {"module", "ms", "lazy"}; one entry per process
+_IMPORT_TIMINGS: Dict[str, dict] = {}
+
+
+def _record(name, elapsed, lazy):
+    if name not in _IMPORT_TIMINGS:
+        _IMPORT_TIMINGS[name] = {"module": name, "ms": elapsed * 1000.0, "lazy": lazy}
+
+
+@contextmanager
+def record_import(name):
+    """Time an eager ``import`` statement the first time it runs in this process"""
+    already_loaded = name in sys.modules
+    start = time.perf_counter()
+    yield
+    if not already_loaded:
+        _record(name, time.perf_counter() - start, lazy=False)
+
+
+def load_module(name):
+    """Import a module by name, recording how long the first import took"""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    _record(name, time.perf_counter() - start, lazy=True)
+    return module
+
+
+class LazyModule:
+    """Stand-in for a module that imports it on first attribute access"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = load_module(self._name)
+        return self._module
+
+    @property
+    def loaded(self):
+        return self._module is not None or self._name in sys.modules
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self.loaded else "not loaded"
+        return f"<LazyModule {self._name!r} ({state})>"
+
+
+def import_timings() -> List[dict]:
+    """Return the recorded imports, slowest first"""
+    return sorted(_IMPORT_TIMINGS.values(), key=lambda row: row["ms"], reverse=True)
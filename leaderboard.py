@@ -0,0 +1,506 @@
+"""Process-wide XP leaderboards for the Finasaur app.
+
+Users are kept ordered by XP in an indexable skip list, so changing one
+user's XP, looking up their rank, or reading the row at a given position
+all cost O(log n), no matter how many learners are on the board. The
+daily, weekly and monthly boards are the same structure, fed from per-day
+XP buckets. Pages read frozen snapshots of the boards that one background
+thread refreshes, rather than the live boards themselves.
+"""
+import datetime
+import gc
+import logging
+from collections import Counter
+from contextlib import contextmanager
+import os
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+
+from sketch import XPSketch
+
+logger = logging.getLogger(__name__)
+
+MAX_LEVELS = 24  # comfortably covers millions of entries
+
+# Seconds between snapshot refreshes
+DEFAULT_REFRESH_INTERVAL = float(os.environ.get("FINIQ_LEADERBOARD_REFRESH", "5"))
+
+
+@contextmanager
+def _gc_paused():
+    """Hold off the cyclic garbage collector while building many acyclic objects
+
+    Otherwise it rescans the growing heap over and over, which costs more
+    than the build itself.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class _End:
+    """Sentinel that sorts after every key"""
+
+    def __lt__(self, other):
+        return False
+
+    def __le__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return True
+
+    def __ge__(self, other):
+        return True
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, next_nodes, widths):
+        self.key = key
+        self.next = next_nodes
+        self.width = widths
+
+
+_NIL = _Node(_End(), [], [])
+
+
+class IndexableSkiplist:
+    """Sorted, unique keys with O(log n) insert, remove, rank and positional lookup
+
+    Every link records how many bottom-level steps it skips, which is what
+    makes rank() and the positional lookups logarithmic.
+    """
+
+    def __init__(self):
+        self.size = 0
+        self.head = _Node(None, [_NIL] * MAX_LEVELS, [1] * MAX_LEVELS)
+
+    @classmethod
+    def from_sorted(cls, keys):
+        """Build a skip list from unique keys already in order, in O(n)
+
+        Links are made left to right, one pass per node, with each link's
+        width taken from the positions of the two nodes it joins.
+        """
+        skiplist = cls()
+        last = [skiplist.head] * MAX_LEVELS
+        last_position = [0] * MAX_LEVELS  # the head sits at position 0
+        position = 0
+        with _gc_paused():
+            for position, key in enumerate(keys, 1):
+                height = _random_height()
+                node = _Node(key, [None] * height, [None] * height)
+                for level in range(height):
+                    last[level].next[level] = node
+                    last[level].width[level] = position - last_position[level]
+                    last[level] = node
+                    last_position[level] = position
+        for level in range(MAX_LEVELS):
+            last[level].next[level] = _NIL
+            last[level].width[level] = position + 1 - last_position[level]
+        skiplist.size = position
+        return skiplist
+
+    def __len__(self):
+        return self.size
+
+    def _node_at(self, index):
+        node = self.head
+        index += 1
+        for level in reversed(range(MAX_LEVELS)):
+            while node.width[level] <= index:
+                index -= node.width[level]
+                node = node.next[level]
+        return node
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        return self._node_at(index).key
+
+    def insert(self, key):
+        chain = [None] * MAX_LEVELS
+        steps_at_level = [0] * MAX_LEVELS
+        node = self.head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level].key <= key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+        height = _random_height()
+        new_node = _Node(key, [None] * height, [None] * height)
+        steps = 0
+        for level in range(height):
+            prev = chain[level]
+            new_node.next[level] = prev.next[level]
+            prev.next[level] = new_node
+            new_node.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(height, MAX_LEVELS):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, key):
+        chain = [None] * MAX_LEVELS
+        node = self.head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+        target = chain[0].next[0]
+        if target is _NIL or target.key != key:
+            raise KeyError(key)
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(len(target.next), MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def rank(self, key):
+        """Number of keys that sort before key (its 0-based position)"""
+        node = self.head
+        position = 0
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        if node.next[0] is _NIL or node.next[0].key != key:
+            raise KeyError(key)
+        return position
+
+    def slice(self, start, stop):
+        """Keys at positions start..stop-1, walking the bottom level"""
+        start = max(start, 0)
+        stop = min(stop, self.size)
+        if start >= stop:
+            return []
+        node = self._node_at(start)
+        keys = []
+        for _ in range(stop - start):
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+def _random_height():
+    height = 1
+    while random.random() < 0.5 and height < MAX_LEVELS:
+        height += 1
+    return height
+
+
+class Leaderboard:
+    """Users ranked by XP (ties broken by username), shared by every session"""
+
+    def __init__(self, rows=()):
+        """Seed the board in bulk; a username listed twice keeps its last row"""
+        self._lock = threading.Lock()
+        with _gc_paused():
+            self._users: Dict[str, dict] = {
+                row['username']: {"username": row['username'], "xp": row['xp'],
+                                  "level": row['level'], "streak": row['streak']}
+                for row in rows}
+            # keys are (-xp, username)
+            self._ranking = IndexableSkiplist.from_sorted(
+                sorted((-row['xp'], username) for username, row in self._users.items()))
+        self.sketch = XPSketch()  # XP distribution, for "top X%"
+        for xp, count in Counter(row['xp'] for row in self._users.values()).items():
+            self.sketch.add(xp, count)
+        self.version = 0
+
+    def __len__(self):
+        return len(self._ranking)
+
+    def update(self, username, xp, level, streak) -> bool:
+        """Insert or move one user; O(log n). Returns False if nothing changed"""
+        row = {"username": username, "xp": xp, "level": level, "streak": streak}
+        with self._lock:
+            old = self._users.get(username)
+            if old == row:
+                return False
+            if old is None:
+                self._ranking.insert((-xp, username))
+                self.sketch.add(xp)
+            elif old['xp'] != xp:
+                self._ranking.remove((-old['xp'], username))
+                self._ranking.insert((-xp, username))
+                self.sketch.remove(old['xp'])
+                self.sketch.add(xp)
+            self._users[username] = row
+            self.version += 1
+            return True
+
+    def remove(self, username):
+        with self._lock:
+            old = self._users.pop(username, None)
+            if old is not None:
+                self._ranking.remove((-old['xp'], username))
+                self.sketch.remove(old['xp'])
+                self.version += 1
+
+    def get(self, username) -> Optional[dict]:
+        with self._lock:
+            row = self._users.get(username)
+            return dict(row) if row else None
+
+    def get_many(self, usernames) -> List[dict]:
+        """Rows for every listed user on the board, read under a single lock"""
+        with self._lock:
+            return [dict(self._users[username]) for username in usernames if username in self._users]
+
+    def freeze(self):
+        """(version, ranked keys, users, sketch) as they are at one instant
+
+        Only the cheap copies are made under the lock; row dicts are replaced,
+        never changed, so the shallow copy of the users can be shared.
+        """
+        with self._lock:
+            return (self.version, self._ranking.slice(0, len(self._ranking)),
+                    dict(self._users), self.sketch.copy())
+
+    def sketch_copy(self) -> XPSketch:
+        with self._lock:
+            return self.sketch.copy()
+
+    def rank(self, username) -> Optional[int]:
+        """1-based position of username, or None if they are not on the board"""
+        with self._lock:
+            row = self._users.get(username)
+            if row is None:
+                return None
+            return self._ranking.rank((-row['xp'], username)) + 1
+
+    def _ranked_rows(self, start, stop):
+        keys = self._ranking.slice(start, stop)
+        return [dict(self._users[username], rank=start + offset + 1)
+                for offset, (_, username) in enumerate(keys)]
+
+    def rows(self, start=0, stop=None) -> List[dict]:
+        """Rows ranked start+1..stop, best first"""
+        with self._lock:
+            stop = len(self._ranking) if stop is None else stop
+            return self._ranked_rows(start, stop)
+
+    def window(self, username, top=10, around=3) -> dict:
+        """The top rows plus the rows just above and below username
+
+        Costs O(log n + top + around) however many users are on the board.
+        The "around" rows never repeat a row already in "top".
+        """
+        with self._lock:
+            result = {"rank": None, "total": len(self._ranking),
+                      "top": self._ranked_rows(0, top), "around": []}
+            row = self._users.get(username)
+            if row is not None:
+                position = self._ranking.rank((-row['xp'], username))
+                result["rank"] = position + 1
+                result["around"] = self._ranked_rows(max(position - around, top), position + around + 1)
+            return result
+
+
+WINDOWS = ("daily", "weekly", "monthly")
+
+
+def period_start(window, day):
+    """First day of the period containing day: the day itself, its Monday, or the 1st"""
+    if window == "daily":
+        return day
+    if window == "weekly":
+        return day - datetime.timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def earliest_period_start(day):
+    """Oldest day any window still needs; older XP buckets can be dropped"""
+    return min(period_start(window, day) for window in WINDOWS)
+
+
+class WindowedLeaderboards:
+    """Daily, weekly and monthly XP rankings fed from per-day XP buckets
+
+    Each award lands in the user's bucket for that day and moves the user on
+    every window's board, so reading a ranking never scans history. A board
+    is only rebuilt from the buckets when its period rolls over, and buckets
+    older than every current period are dropped at that point, so memory
+    stays at roughly one month of days per active user.
+    """
+
+    def __init__(self, buckets=(), today=None):
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, Dict[datetime.date, int]] = {}  # username -> day -> xp
+        self._stats: Dict[str, tuple] = {}  # username -> (level, streak)
+        self._boards: Dict[str, tuple] = {}  # window -> (period start, Leaderboard)
+        for row in buckets:
+            days = self._buckets.setdefault(row['username'], {})
+            days[row['day']] = days.get(row['day'], 0) + row['xp']
+            self._stats[row['username']] = (row['level'], row['streak'])
+        with self._lock:
+            self._roll(today or datetime.date.today())
+
+    def _roll(self, today):
+        rolled = False
+        for window in WINDOWS:
+            period = period_start(window, today)
+            if window in self._boards and self._boards[window][0] == period:
+                continue
+            rolled = True
+            board = Leaderboard()
+            for username, days in self._buckets.items():
+                xp = sum(amount for day, amount in days.items() if day >= period)
+                if xp:
+                    board.update(username, xp, *self._stats[username])
+            self._boards[window] = (period, board)
+        if rolled:
+            cutoff = earliest_period_start(today)
+            for username in list(self._buckets):
+                days = self._buckets[username]
+                for day in [day for day in days if day < cutoff]:
+                    del days[day]
+                if not days:
+                    del self._buckets[username]
+                    del self._stats[username]
+
+    def add(self, username, amount, level, streak, day=None) -> int:
+        """Record XP earned on day; returns the user's XP total for that day"""
+        day = day or datetime.date.today()
+        with self._lock:
+            self._roll(day)
+            days = self._buckets.setdefault(username, {})
+            days[day] = days.get(day, 0) + amount
+            self._stats[username] = (level, streak)
+            for _, board in self._boards.values():
+                row = board.get(username)
+                board.update(username, (row['xp'] if row else 0) + amount, level, streak)
+            return days[day]
+
+    def update_stats(self, username, level, streak):
+        """Refresh the level and streak shown next to a user's period XP"""
+        with self._lock:
+            if username not in self._stats:
+                return
+            self._stats[username] = (level, streak)
+            for _, board in self._boards.values():
+                row = board.get(username)
+                if row:
+                    board.update(username, row['xp'], level, streak)
+
+    def rename(self, old_username, new_username):
+        with self._lock:
+            if old_username not in self._buckets:
+                return
+            self._buckets[new_username] = self._buckets.pop(old_username)
+            self._stats[new_username] = self._stats.pop(old_username)
+            for _, board in self._boards.values():
+                row = board.get(old_username)
+                if row:
+                    board.remove(old_username)
+                    board.update(new_username, row['xp'], row['level'], row['streak'])
+
+    def board(self, window, today=None):
+        """(period start, Leaderboard) for the window's current period"""
+        with self._lock:
+            self._roll(today or datetime.date.today())
+            return self._boards[window]
+
+
+class Snapshot:
+    """A frozen copy of one board; any thread may read it without locking"""
+
+    __slots__ = ('period', 'version', 'taken_at', 'rows', 'ranks', 'sketch')
+
+    def __init__(self, period, version, taken_at, rows, ranks, sketch):
+        self.period = period
+        self.version = version
+        self.taken_at = taken_at
+        self.rows = rows  # tuple of row dicts with 'rank', best first
+        self.ranks = ranks  # username -> rank
+        self.sketch = sketch
+
+    @classmethod
+    def of(cls, period, board):
+        # The rows are built outside the board's lock, so clicks are not held up
+        version, keys, users, sketch = board.freeze()
+        ranks = {username: rank for rank, (_, username) in enumerate(keys, 1)}
+        rows = tuple(dict(users[username], rank=rank) for username, rank in ranks.items())
+        return cls(period, version, time.time(), rows, ranks, sketch)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def age(self):
+        return time.time() - self.taken_at
+
+    def rank(self, username) -> Optional[int]:
+        return self.ranks.get(username)
+
+    def top_percent(self, xp) -> float:
+        """Approximate "top X%" for this much XP, independent of board size"""
+        return self.sketch.top_percent(xp)
+
+    def user_top_percent(self, username) -> Optional[float]:
+        """top_percent() for username's XP on this board as of the snapshot, or None if they are not on it"""
+        rank = self.ranks.get(username)
+        if rank is None:
+            return None
+        return self.sketch.top_percent(self.rows[rank - 1]['xp'])
+
+    def window(self, username, top=10, around=3) -> dict:
+        """Same shape as Leaderboard.window(), answered from the snapshot"""
+        rank = self.ranks.get(username)
+        result = {"rank": rank, "total": len(self.rows), "top": list(self.rows[:top]), "around": []}
+        if rank is not None:
+            result["around"] = list(self.rows[max(rank - 1 - around, top):rank + around])
+        return result
+
+
+class SnapshotPublisher:
+    """One background thread that re-materializes every board's snapshot on an interval
+
+    boards() returns {name: (period start, board)}. Snapshots are swapped in
+    as a whole new dict, so readers never see a half-built one and never
+    wait on a lock; a page view costs the same however many users there are.
+    """
+
+    def __init__(self, boards, interval=DEFAULT_REFRESH_INTERVAL):
+        self.boards = boards
+        self.interval = interval
+        self.snapshots: Dict[object, Snapshot] = {}
+        self._stopping = threading.Event()
+        self.refresh()
+        self._thread = threading.Thread(target=self._run, name="finiq-leaderboard-snapshots", daemon=True)
+        self._thread.start()
+
+    def refresh(self):
+        snapshots = {}
+        for name, (period, board) in self.boards().items():
+            old = self.snapshots.get(name)
+            if old is not None and old.period == period and old.version == board.version:
+                # Nothing moved; keep the rows but mark them as checked just now
+                snapshots[name] = Snapshot(period, old.version, time.time(), old.rows, old.ranks, old.sketch)
+            else:
+                snapshots[name] = Snapshot.of(period, board)
+        self.snapshots = snapshots
+
+    def get(self, name) -> Snapshot:
+        return self.snapshots[name]
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Failed to refresh leaderboard snapshots")
+
+    def stop(self):
+        self._stopping.set()
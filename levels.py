@@ -0,0 +1,108 @@
+"""XP level curve for the Finasaur app.
+
+Levels come from a table of XP thresholds: level n starts at thresholds[n-1].
+Past the end of the table every further level costs as much as the last
+step did. A level lookup is one bisect, and "XP to next level" is a lookup
+of the following threshold.
+
+The default table keeps the original curve (a level every 400 XP). Point
+FINIQ_LEVEL_CURVE at a JSON file holding a list of thresholds to use another
+one, then recompute every stored profile's level offline:
+
+    python levels.py [--db finasaur.db] [--chunk-size 100000]
+"""
+import argparse
+import bisect
+import json
+import os
+import time
+from typing import Optional
+
+from lazy_imports import LazyModule
+
+np = LazyModule("numpy")
+
+LEVEL_CURVE_PATH = os.environ.get("FINIQ_LEVEL_CURVE")
+DEFAULT_THRESHOLDS = [400 * level for level in range(100)]
+RECOMPUTE_CHUNK_SIZE = 100000
+
+
+class LevelCurve:
+    """Sorted XP thresholds with bisect lookups"""
+
+    def __init__(self, thresholds):
+        thresholds = sorted(set(thresholds))
+        if len(thresholds) < 2 or thresholds[0] != 0:
+            raise ValueError("A level curve needs at least two thresholds, starting at 0")
+        self.thresholds = thresholds
+        self.last = thresholds[-1]
+        self.step = thresholds[-1] - thresholds[-2]  # cost of every level past the table
+
+    def level(self, xp) -> int:
+        if xp >= self.last:
+            return len(self.thresholds) + (xp - self.last) // self.step
+        return bisect.bisect_right(self.thresholds, xp)
+
+    def level_start(self, level) -> int:
+        """XP at which level begins"""
+        if level <= len(self.thresholds):
+            return self.thresholds[level - 1]
+        return self.last + (level - len(self.thresholds)) * self.step
+
+    def xp_to_next(self, xp) -> int:
+        return self.level_start(self.level(xp) + 1) - xp
+
+    def levels(self, xp):
+        """level() for a whole numpy array of XP values at once"""
+        xp = np.asarray(xp, dtype=np.int64)
+        levels = np.searchsorted(np.asarray(self.thresholds, dtype=np.int64), xp, side='right')
+        beyond = xp >= self.last
+        levels[beyond] = len(self.thresholds) + (xp[beyond] - self.last) // self.step
+        return levels
+
+
+def load_curve(path: Optional[str] = LEVEL_CURVE_PATH) -> LevelCurve:
+    """The curve from a JSON list of thresholds, or the default one"""
+    if not path:
+        return LevelCurve(DEFAULT_THRESHOLDS)
+    with open(path, 'r', encoding='utf-8') as curve_file:
+        return LevelCurve(json.load(curve_file))
+
+
+def recompute_levels(store, curve, chunk_size=RECOMPUTE_CHUNK_SIZE, journal_path=None) -> int:
+    """Bring every stored profile's level in line with curve; returns how many changed
+
+    Saves still waiting in the app's journal are applied first, so they
+    cannot later overwrite the new levels. Run it with the app stopped.
+    """
+    from journal import DEFAULT_JOURNAL_PATH, replay_pending
+
+    replay_pending(journal_path or DEFAULT_JOURNAL_PATH, store.apply_events)
+    changed = 0
+    for usernames, xp, old_levels in store.level_chunks(chunk_size):
+        new_levels = curve.levels(xp)
+        moved = np.flatnonzero(new_levels != np.asarray(old_levels, dtype=np.int64)).tolist()
+        if moved:
+            store.save_levels([(usernames[row], int(new_levels[row])) for row in moved])
+            changed += len(moved)
+    return changed
+
+
+def main():
+    from storage import DEFAULT_DB_PATH, ProfileStore
+
+    parser = argparse.ArgumentParser(description="Recompute every stored profile's level from the level curve")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="profile database (default: %(default)s)")
+    parser.add_argument("--chunk-size", type=int, default=RECOMPUTE_CHUNK_SIZE, help="profiles per chunk")
+    args = parser.parse_args()
+    if not os.path.exists(args.db):
+        parser.error(f"no database at {args.db}")
+    start = time.perf_counter()
+    store = ProfileStore(args.db)
+    changed = recompute_levels(store, load_curve(), args.chunk_size)
+    store.close()
+    print(f"Updated the level of {changed} profiles in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""Profiles shared by every session signed in to them, for the Finasaur app.
+
+Each browser tab is its own Streamlit session. Tabs on the same profile (the
+same ``?sid=`` token) share one ``UserData`` object rather than each keeping
+a copy, so a save from any tab carries what the other tabs changed instead
+of overwriting it. The registry only holds the objects weakly: a profile
+drops out once the last session using it is gone.
+"""
+import threading
+import weakref
+from typing import Callable, Optional
+
+
+class UserData(dict):
+    """A signed-in user's progress and settings; a dict that can be weakly referenced"""
+
+
+class OpenProfiles:
+    """token -> the UserData shared by the sessions on that profile"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._profiles = weakref.WeakValueDictionary()
+
+    def __len__(self):
+        return len(self._profiles)
+
+    def open(self, token, load: Callable[[], Optional[UserData]]) -> Optional[UserData]:
+        """The UserData for token, from load() if no session has it open; None if load finds nothing"""
+        with self._lock:
+            user_data = self._profiles.get(token)
+            if user_data is None:
+                user_data = load()
+                if user_data is not None:
+                    self._profiles[token] = user_data
+            return user_data
+
+    def add(self, token, user_data):
+        """Share a session's freshly created profile with sessions that open it later"""
+        with self._lock:
+            self._profiles[token] = user_data
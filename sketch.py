@@ -0,0 +1,104 @@
+"""Streaming quantile sketch of XP for the Finasaur leaderboards.
+
+A DDSketch-style sketch: values are counted in logarithmically sized buckets,
+so any quantile it reports is within ``relative_accuracy`` of the true value,
+and the number of buckets depends on the XP range, not on how many users
+there are. Sketches with the same accuracy merge by adding bucket counts,
+which lets separate worker processes combine what they have seen.
+"""
+import math
+from typing import Dict
+
+DEFAULT_RELATIVE_ACCURACY = 0.01
+
+
+class XPSketch:
+    """Counts of non-negative XP values in log-spaced buckets"""
+
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.zero_count = 0  # values <= 0 sit below every bucket
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+
+    def _index(self, value):
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _bucket_value(self, index):
+        return 2 * self.gamma ** index / (1 + self.gamma)
+
+    def add(self, value, count=1):
+        if value <= 0:
+            self.zero_count += count
+        else:
+            index = self._index(value)
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += count
+
+    def remove(self, value):
+        """Forget one earlier add(value), e.g. when a user's XP changes"""
+        if value <= 0:
+            self.zero_count -= 1
+        else:
+            index = self._index(value)
+            if self.buckets[index] == 1:
+                del self.buckets[index]
+            else:
+                self.buckets[index] -= 1
+        self.count -= 1
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        self.zero_count += other.zero_count
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+
+    def copy(self):
+        sketch = XPSketch(self.relative_accuracy)
+        sketch.merge(self)
+        return sketch
+
+    def quantile(self, q):
+        """Approximate XP at quantile q (0 = lowest, 1 = highest)"""
+        if self.count == 0:
+            return None
+        target = q * (self.count - 1)
+        seen = self.zero_count
+        if target < seen:
+            return 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if target < seen:
+                return self._bucket_value(index)
+        return self._bucket_value(max(self.buckets))
+
+    def top_percent(self, value):
+        """Approximate share of users, in percent, with at least this much XP"""
+        if self.count == 0:
+            return 100.0
+        if value <= 0:
+            at_least = self.count
+        else:
+            index = self._index(value)
+            at_least = sum(count for bucket, count in self.buckets.items() if bucket >= index)
+        return 100.0 * max(at_least, 1) / self.count
+
+    def to_dict(self):
+        """Plain dict form, for handing a sketch to another process"""
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "zero_count": self.zero_count,
+            "buckets": {str(index): count for index, count in self.buckets.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["relative_accuracy"])
+        sketch.zero_count = data["zero_count"]
+        sketch.buckets = {int(index): count for index, count in data["buckets"].items()}
+        sketch.count = sketch.zero_count + sum(sketch.buckets.values())
+        return sketch
@@ -0,0 +1,436 @@
+"""SQLite-backed profile store for the Finasaur app.
+
+The database runs in WAL mode so the many reader threads Streamlit starts
+(one per script run) never block the writer. Each thread gets its own
+connection from ``ConnectionPool``; connections belonging to threads that
+have exited are closed the next time a connection is handed out.
+"""
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from typing import Dict, List, Optional
+
+from journal import ANSWER, FRIEND, PROFILE, XP
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = os.environ.get(
+    "FINIQ_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "finasaur.db"),
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    username TEXT PRIMARY KEY,
+    token TEXT NOT NULL UNIQUE,
+    level INTEGER NOT NULL DEFAULT 1,
+    xp INTEGER NOT NULL DEFAULT 0,
+    coins INTEGER NOT NULL DEFAULT 100,
+    streak INTEGER NOT NULL DEFAULT 0,
+    last_login TEXT,
+    correct_answers INTEGER NOT NULL DEFAULT 0,
+    total_questions INTEGER NOT NULL DEFAULT 0,
+    completed_lessons TEXT NOT NULL DEFAULT '[]',
+    badges TEXT NOT NULL DEFAULT '[]',
+    perfect_lessons TEXT NOT NULL DEFAULT '[]',
+    avatar TEXT NOT NULL DEFAULT '🦖',
+    account_type TEXT NOT NULL DEFAULT 'Home',
+    night_mode INTEGER NOT NULL DEFAULT 0,
+    avatar_unlocked INTEGER NOT NULL DEFAULT 0,
+    badge_progress TEXT NOT NULL DEFAULT '{}',
+    activity TEXT NOT NULL DEFAULT '{}',
+    streak_protectors INTEGER NOT NULL DEFAULT 0,
+    effects TEXT NOT NULL DEFAULT '{}',
+    updated_at REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS xp_daily (
+    username TEXT NOT NULL,
+    day TEXT NOT NULL,
+    xp INTEGER NOT NULL,
+    PRIMARY KEY (username, day)
+);
+CREATE TABLE IF NOT EXISTS friendships (
+    username TEXT NOT NULL,
+    friend TEXT NOT NULL,
+    PRIMARY KEY (username, friend)
+);
+CREATE TABLE IF NOT EXISTS friend_requests (
+    sender TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    PRIMARY KEY (sender, recipient)
+);
+"""
+
+# Columns stored as JSON arrays
+LIST_COLUMNS = ('completed_lessons', 'badges', 'perfect_lessons')
+# Columns stored as JSON objects
+DICT_COLUMNS = ('badge_progress', 'activity', 'effects')
+BOOL_COLUMNS = ('night_mode', 'avatar_unlocked')
+PROFILE_COLUMNS = (
+    'username', 'token', 'level', 'xp', 'coins', 'streak', 'last_login',
+    'correct_answers', 'total_questions', 'completed_lessons', 'badges',
+    'perfect_lessons', 'avatar', 'account_type', 'night_mode', 'avatar_unlocked',
+    'badge_progress', 'activity', 'streak_protectors', 'effects',
+)
+# Profile columns added after the first release: name -> column definition
+ADDED_COLUMNS = {
+    'badge_progress': "TEXT NOT NULL DEFAULT '{}'",
+    'activity': "TEXT NOT NULL DEFAULT '{}'",
+    'streak_protectors': "INTEGER NOT NULL DEFAULT 0",
+    'effects': "TEXT NOT NULL DEFAULT '{}'",
+}
+# Values for added columns that profiles journaled before they existed lack
+ADDED_COLUMN_DEFAULTS = {
+    'streak_protectors': 0,
+}
+# Profile columns from before the friend graph got its own tables
+LEGACY_FRIEND_COLUMNS = ('friends', 'friend_requests_sent', 'friend_requests_received')
+
+# SQL text is kept constant so each connection's statement cache compiles
+# these once and reuses the prepared statement on every call.
+RECORD_ANSWER_SQL = (
+    "UPDATE profiles SET total_questions = ?, correct_answers = ?, xp = ?, "
+    "coins = ?, level = ?, badge_progress = COALESCE(?, badge_progress), "
+    "updated_at = ? WHERE token = ?"
+)
+INSERT_PROFILE_SQL = "INSERT INTO profiles ({}, updated_at) VALUES ({}, ?)".format(
+    ', '.join(PROFILE_COLUMNS), ', '.join('?' * len(PROFILE_COLUMNS)))
+UPSERT_PROFILE_SQL = INSERT_PROFILE_SQL + " ON CONFLICT(username) DO UPDATE SET {}".format(
+    ', '.join(f"{column} = excluded.{column}" for column in PROFILE_COLUMNS[2:] + ('updated_at',)))
+# Everything but the username and token, which only claiming a name changes
+UPDATE_PROFILE_SQL = "UPDATE profiles SET {}, updated_at = ? WHERE token = ?".format(
+    ', '.join(f"{column} = ?" for column in PROFILE_COLUMNS[2:]))
+SELECT_PROFILE_SQL = "SELECT {} FROM profiles WHERE username = ?".format(', '.join(PROFILE_COLUMNS))
+SELECT_BY_TOKEN_SQL = "SELECT {} FROM profiles WHERE token = ?".format(', '.join(PROFILE_COLUMNS))
+SELECT_TOKEN_SQL = "SELECT token FROM profiles WHERE username = ?"
+SELECT_USERNAME_SQL = "SELECT username FROM profiles WHERE token = ?"
+RENAME_PROFILE_SQL = "UPDATE profiles SET username = ?, updated_at = ? WHERE username = ?"
+SELECT_USERNAMES_SQL = "SELECT username FROM profiles"
+SELECT_COMPLETED_LESSONS_SQL = "SELECT username, completed_lessons FROM profiles WHERE completed_lessons != '[]'"
+# One chunk of badge counters, keyed by rowid so each chunk is an index range scan
+BADGE_COUNTERS_CHUNK_SQL = (
+    "SELECT rowid, username, badges, json_array_length(completed_lessons), "
+    "json_array_length(perfect_lessons), correct_answers, streak, coins, xp "
+    "FROM profiles WHERE rowid > ? ORDER BY rowid LIMIT ?"
+)
+BADGE_COUNTER_COLUMNS = ('completed_lessons', 'perfect_lessons', 'correct_answers', 'streak', 'coins', 'xp')
+SAVE_BADGES_SQL = "UPDATE profiles SET badges = ?, updated_at = ? WHERE username = ?"
+LEVEL_CHUNK_SQL = "SELECT rowid, username, xp, level FROM profiles WHERE rowid > ? ORDER BY rowid LIMIT ?"
+SAVE_LEVEL_SQL = "UPDATE profiles SET level = ?, updated_at = ? WHERE username = ?"
+LEADERBOARD_ROWS_SQL = "SELECT username, xp, level, streak FROM profiles"
+RECORD_XP_SQL = (
+    "INSERT INTO xp_daily (username, day, xp) SELECT username, ?, ? FROM profiles WHERE token = ? "
+    "ON CONFLICT(username, day) DO UPDATE SET xp = excluded.xp"
+)
+RENAME_XP_SQL = "UPDATE xp_daily SET username = ? WHERE username = ?"
+XP_BUCKET_ROWS_SQL = (
+    "SELECT b.username, b.day, b.xp, p.level, p.streak FROM xp_daily b "
+    "JOIN profiles p ON p.username = b.username WHERE b.day >= ?"
+)
+PRUNE_XP_SQL = "DELETE FROM xp_daily WHERE day < ?"
+ADD_FRIEND_REQUEST_SQL = "INSERT OR IGNORE INTO friend_requests (sender, recipient) VALUES (?, ?)"
+DELETE_FRIEND_REQUEST_SQL = "DELETE FROM friend_requests WHERE sender = ? AND recipient = ?"
+SELECT_FRIENDSHIPS_SQL = "SELECT username, friend FROM friendships"
+SELECT_FRIEND_REQUESTS_SQL = "SELECT sender, recipient FROM friend_requests"
+ADD_FRIENDSHIP_SQL = "INSERT OR IGNORE INTO friendships (username, friend) VALUES (?, ?)"
+RENAME_FRIEND_SQL = (
+    "UPDATE friendships SET username = ? WHERE username = ?",
+    "UPDATE friendships SET friend = ? WHERE friend = ?",
+    "UPDATE friend_requests SET sender = ? WHERE sender = ?",
+    "UPDATE friend_requests SET recipient = ? WHERE recipient = ?",
+)
+
+STATEMENT_CACHE_SIZE = 64
+
+
+class ConnectionPool:
+    """Hands each thread its own SQLite connection"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # thread ident -> (weakref to the owning thread, connection)
+        self._connections = {}
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=30,
+            check_same_thread=False,  # so the pool can close it after its thread exits
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def connection(self):
+        """Return this thread's connection, opening one on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._lock:
+                self._close_dead()
+                self._connections[threading.get_ident()] = (weakref.ref(threading.current_thread()), conn)
+        return conn
+
+    def _close_dead(self):
+        for ident, (thread_ref, conn) in list(self._connections.items()):
+            thread = thread_ref()
+            if thread is None or not thread.is_alive():
+                conn.close()
+                del self._connections[ident]
+
+    def close_all(self):
+        with self._lock:
+            for _, conn in self._connections.values():
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+def _to_row(profile):
+    row = []
+    for column in PROFILE_COLUMNS:
+        value = profile.get(column, ADDED_COLUMN_DEFAULTS.get(column))
+        if column in LIST_COLUMNS:
+            value = json.dumps(list(value or []))
+        elif column in DICT_COLUMNS:
+            value = json.dumps(dict(value or {}))
+        elif column in BOOL_COLUMNS:
+            value = int(bool(value))
+        row.append(value)
+    return row
+
+
+def _from_row(row):
+    profile = dict(zip(PROFILE_COLUMNS, row))
+    for column in LIST_COLUMNS + DICT_COLUMNS:
+        profile[column] = json.loads(profile[column])
+    for column in BOOL_COLUMNS:
+        profile[column] = bool(profile[column])
+    return profile
+
+
+class ProfileStore:
+    """Loads and saves user profiles keyed by username"""
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.pool = ConnectionPool(path)
+        conn = self.pool.connection()
+        with conn:
+            conn.executescript(SCHEMA)
+            self._add_missing_columns(conn)
+            self._migrate_friend_lists(conn)
+
+    @staticmethod
+    def _add_missing_columns(conn):
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(profiles)")}
+        for column, definition in ADDED_COLUMNS.items():
+            if column not in columns:
+                conn.execute(f"ALTER TABLE profiles ADD COLUMN {column} {definition}")
+
+    @staticmethod
+    def _migrate_friend_lists(conn):
+        """Move friend lists kept on old profile rows into the friend graph tables"""
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(profiles)")}
+        if not columns.issuperset(LEGACY_FRIEND_COLUMNS):
+            return
+        rows = conn.execute(
+            "SELECT username, friends, friend_requests_sent FROM profiles "
+            "WHERE friends != '[]' OR friend_requests_sent != '[]'").fetchall()
+        for row in rows:
+            for friend in json.loads(row['friends']):
+                conn.execute(ADD_FRIENDSHIP_SQL, (row['username'], friend))
+                conn.execute(ADD_FRIENDSHIP_SQL, (friend, row['username']))
+            for recipient in json.loads(row['friend_requests_sent']):
+                conn.execute(ADD_FRIEND_REQUEST_SQL, (row['username'], recipient))
+        # Only rows still holding lists, so later starts find nothing to rewrite
+        conn.execute("UPDATE profiles SET friends = '[]', friend_requests_sent = '[]', "
+                     "friend_requests_received = '[]' WHERE friends != '[]' "
+                     "OR friend_requests_sent != '[]' OR friend_requests_received != '[]'")
+
+    def load_profile(self, username) -> Optional[Dict]:
+        row = self.pool.connection().execute(SELECT_PROFILE_SQL, (username,)).fetchone()
+        return _from_row(row) if row else None
+
+    def load_profile_by_token(self, token) -> Optional[Dict]:
+        row = self.pool.connection().execute(SELECT_BY_TOKEN_SQL, (token,)).fetchone()
+        return _from_row(row) if row else None
+
+    def create_profile(self, profile) -> bool:
+        """Insert a new profile; returns False if the username is already taken"""
+        conn = self.pool.connection()
+        try:
+            with conn:
+                conn.execute(INSERT_PROFILE_SQL, _to_row(profile) + [time.time()])
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def save_profile(self, profile):
+        conn = self.pool.connection()
+        with conn:
+            conn.execute(UPSERT_PROFILE_SQL, _to_row(profile) + [time.time()])
+
+    def rename_profile(self, old_username, new_username) -> bool:
+        """Move a profile to a new username; returns False if that name is taken"""
+        conn = self.pool.connection()
+        try:
+            with conn:
+                conn.execute(RENAME_PROFILE_SQL, (new_username, time.time(), old_username))
+                conn.execute(RENAME_XP_SQL, (new_username, old_username))
+                for sql in RENAME_FRIEND_SQL:
+                    conn.execute(sql, (new_username, old_username))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def usernames(self) -> List[str]:
+        return [row[0] for row in self.pool.connection().execute(SELECT_USERNAMES_SQL)]
+
+    def completed_lessons(self) -> Dict[str, List[str]]:
+        """username -> completed lesson names, for users who have completed any"""
+        rows = self.pool.connection().execute(SELECT_COMPLETED_LESSONS_SQL)
+        return {username: json.loads(lessons) for username, lessons in rows}
+
+    def leaderboard_rows(self) -> List[Dict]:
+        """Every profile's username, xp, level and streak, unordered"""
+        return [dict(row) for row in self.pool.connection().execute(LEADERBOARD_ROWS_SQL)]
+
+    def xp_bucket_rows(self, since) -> List[Dict]:
+        """Daily XP buckets from since onwards, with each user's level and streak"""
+        rows = self.pool.connection().execute(XP_BUCKET_ROWS_SQL, (since.isoformat(),))
+        return [dict(row, day=datetime.date.fromisoformat(row['day'])) for row in rows]
+
+    def prune_xp_buckets(self, before):
+        """Drop daily XP buckets older than before; all-time XP stays on the profile"""
+        conn = self.pool.connection()
+        with conn:
+            conn.execute(PRUNE_XP_SQL, (before.isoformat(),))
+
+    def friend_graph_rows(self):
+        """(friendships, pending requests) as lists of username pairs"""
+        conn = self.pool.connection()
+        friendships = [tuple(row) for row in conn.execute(SELECT_FRIENDSHIPS_SQL)]
+        requests = [tuple(row) for row in conn.execute(SELECT_FRIEND_REQUESTS_SQL)]
+        return friendships, requests
+
+    def badge_counter_chunks(self, chunk_size):
+        """Yield every profile's badge counters, chunk_size profiles at a time, as columns
+
+        Each chunk is {"username": [...], "badges": [[...], ...], counter: [...]}
+        with lesson lists already reduced to their lengths.
+        """
+        conn = self.pool.connection()
+        last_rowid = 0
+        while True:
+            rows = conn.execute(BADGE_COUNTERS_CHUNK_SQL, (last_rowid, chunk_size)).fetchall()
+            if not rows:
+                return
+            last_rowid = rows[-1][0]
+            columns = list(zip(*rows))
+            chunk = {"username": list(columns[1]), "badges": [json.loads(value) for value in columns[2]]}
+            for column, values in zip(BADGE_COUNTER_COLUMNS, columns[3:]):
+                chunk[column] = values
+            yield chunk
+
+    def save_badges(self, updates):
+        """Write (username, badge list) pairs in one transaction"""
+        conn = self.pool.connection()
+        now = time.time()
+        with conn:
+            conn.executemany(SAVE_BADGES_SQL, [(json.dumps(names), now, username) for username, names in updates])
+
+    def level_chunks(self, chunk_size):
+        """Yield (usernames, xp, levels) columns, chunk_size profiles at a time"""
+        conn = self.pool.connection()
+        last_rowid = 0
+        while True:
+            rows = conn.execute(LEVEL_CHUNK_SQL, (last_rowid, chunk_size)).fetchall()
+            if not rows:
+                return
+            last_rowid = rows[-1][0]
+            _, usernames, xp, levels = zip(*rows)
+            yield list(usernames), xp, levels
+
+    def save_levels(self, updates):
+        """Write (username, level) pairs in one transaction"""
+        conn = self.pool.connection()
+        now = time.time()
+        with conn:
+            conn.executemany(SAVE_LEVEL_SQL, [(level, now, username) for username, level in updates])
+
+    def apply_events(self, events) -> List[Dict]:
+        """Apply a batch of journal events, in order, in a single transaction
+
+        Each event runs in its own savepoint, so one the store rejects is
+        rolled back alone and returned instead of failing the whole batch.
+        Answer events are the hot path and only touch the counters a Submit
+        Answer changes.
+        """
+        conn = self.pool.connection()
+        now = time.time()
+        rejected = []
+        with conn:
+            conn.execute("BEGIN")  # else releasing each savepoint would commit it on its own
+            for event in events:
+                conn.execute("SAVEPOINT event")
+                try:
+                    self._apply_event(conn, event, now)
+                except sqlite3.DatabaseError:
+                    logger.exception("Rejected journal event %r", event)
+                    conn.execute("ROLLBACK TO event")
+                    rejected.append(event)
+                conn.execute("RELEASE event")
+        return rejected
+
+    def _apply_event(self, conn, event, now):
+        if event['t'] == ANSWER:
+            counters, progress = event['v'][:5], event['v'][5:]
+            # Journals written before badge progress existed have no progress to save
+            progress = json.dumps(progress[0]) if progress else None
+            conn.execute(RECORD_ANSWER_SQL, (*counters, progress, now, self._event_token(conn, event)))
+        elif event['t'] == PROFILE:
+            row = _to_row(event['v'])[2:]
+            conn.execute(UPDATE_PROFILE_SQL, row + [now, self._event_token(conn, event)])
+        elif event['t'] == XP:
+            conn.execute(RECORD_XP_SQL, (*event['v'], self._event_token(conn, event)))
+        elif event['t'] == FRIEND:
+            self._apply_friend_event(conn, self._event_username(conn, event), *event['v'])
+
+    @staticmethod
+    def _event_token(conn, event):
+        """The token of the profile an event is for; older journals only name the user"""
+        if 'k' in event:
+            return event['k']
+        row = conn.execute(SELECT_TOKEN_SQL, (event['u'],)).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _event_username(conn, event):
+        """The current username of the profile an event is for, which may have changed since"""
+        if 'k' not in event:
+            return event['u']
+        row = conn.execute(SELECT_USERNAME_SQL, (event['k'],)).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _apply_friend_event(conn, username, action, other_username):
+        if action == "request":
+            conn.execute(ADD_FRIEND_REQUEST_SQL, (username, other_username))
+            return
+        conn.execute(DELETE_FRIEND_REQUEST_SQL, (other_username, username))
+        if action == "accept":
+            conn.execute(ADD_FRIENDSHIP_SQL, (username, other_username))
+            conn.execute(ADD_FRIENDSHIP_SQL, (other_username, username))
+
+    def close(self):
+        self.pool.close_all()
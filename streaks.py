@@ -0,0 +1,119 @@
+"""Daily activity calendar and streaks for the Finasaur app.
+
+Each user's active days are kept as one bitmap per year, a Python int with
+bit n set when the user was active on day n of that year (0 = January 1st).
+A year costs at most 46 bytes, and streaks come from bit operations instead
+of walking dates: the current streak is the run of set bits ending today,
+the longest is how many times ``x &= x >> 1`` can run before x is empty.
+
+Streak Protector tokens fill missed days: protected days sit in a second
+bitmap, so they keep a streak alive without counting as activity.
+"""
+import datetime
+from typing import Dict
+
+
+def _year_offset(year, first_year):
+    """Bit position of January 1st of year in a span starting at first_year"""
+    return datetime.date(year, 1, 1).toordinal() - datetime.date(first_year, 1, 1).toordinal()
+
+
+class ActivityCalendar:
+    """Active and protected days as per-year bitmaps"""
+
+    def __init__(self, active=None, protected=None):
+        self.active: Dict[int, int] = dict(active or {})
+        self.protected: Dict[int, int] = dict(protected or {})
+
+    def __bool__(self):
+        return any(self.active.values())
+
+    @staticmethod
+    def _set(bitmaps, day):
+        bitmaps[day.year] = bitmaps.get(day.year, 0) | 1 << (day.timetuple().tm_yday - 1)
+
+    def is_active(self, day) -> bool:
+        return bool(self.active.get(day.year, 0) >> (day.timetuple().tm_yday - 1) & 1)
+
+    def mark_active(self, day) -> bool:
+        """Record activity on day; returns False if it was already recorded"""
+        if self.is_active(day):
+            return False
+        self._set(self.active, day)
+        return True
+
+    def _span(self):
+        """(first year, every covered day of every year as one bitmap)"""
+        years = sorted(set(self.active) | set(self.protected))
+        if not years:
+            return None, 0
+        span = 0
+        for year in years:
+            span |= (self.active.get(year, 0) | self.protected.get(year, 0)) << _year_offset(year, years[0])
+        return years[0], span
+
+    def last_covered_day(self):
+        """The latest active or protected day, or None for an empty calendar"""
+        first_year, span = self._span()
+        if not span:
+            return None
+        return datetime.date(first_year, 1, 1) + datetime.timedelta(days=span.bit_length() - 1)
+
+    def current_streak(self, today) -> int:
+        """Covered days in a row ending today, or yesterday if today has no activity yet"""
+        first_year, span = self._span()
+        if not span or today.year < first_year:
+            return 0
+        position = (today - datetime.date(first_year, 1, 1)).days
+        if not span >> position & 1:
+            position -= 1  # the streak is still alive until today is over
+        if position < 0 or not span >> position & 1:
+            return 0
+        gaps = ~span & ((1 << (position + 1)) - 1)  # uncovered days up to position
+        return position - (gaps.bit_length() - 1)
+
+    def longest_streak(self) -> int:
+        _, span = self._span()
+        longest = 0
+        while span:
+            span &= span >> 1  # every run of covered days loses one day
+            longest += 1
+        return longest
+
+    def protect_gap(self, today, tokens) -> int:
+        """Cover the days missed since the last covered day with up to tokens tokens
+
+        Only a gap the tokens can cover completely is filled, since a partly
+        covered gap would not save the streak. Returns the tokens used.
+        """
+        last = self.last_covered_day()
+        if last is None:
+            return 0
+        missed = (today - last).days - 1
+        if missed <= 0 or missed > tokens:
+            return 0
+        for offset in range(1, missed + 1):
+            self._set(self.protected, last + datetime.timedelta(days=offset))
+        return missed
+
+    @classmethod
+    def seeded(cls, last_day, streak):
+        """A calendar with streak active days ending on last_day, for profiles from before calendars"""
+        calendar = cls()
+        for offset in range(streak):
+            calendar._set(calendar.active, last_day - datetime.timedelta(days=offset))
+        return calendar
+
+    def to_dict(self):
+        """Plain dict form for storage, bitmaps as hex strings"""
+        return {
+            "active": {str(year): format(bits, 'x') for year, bits in self.active.items()},
+            "protected": {str(year): format(bits, 'x') for year, bits in self.protected.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            {int(year): int(bits, 16) for year, bits in data.get("active", {}).items()},
+            {int(year): int(bits, 16) for year, bits in data.get("protected", {}).items()},
+        )
@@ -0,0 +1,115 @@
+"""Batch "People you may know" suggestions for the Finasaur app.
+
+A background thread periodically rebuilds every user's suggestions at once
+with sparse matrix products: squaring the friend adjacency matrix counts
+mutual friends for every pair, and a user x lesson matrix counts the lessons
+each candidate pair has both completed. Only the top few per user are kept,
+so the Friends page just looks its list up.
+"""
+import logging
+import os
+import threading
+from typing import Dict, List
+
+from lazy_imports import LazyModule
+
+logger = logging.getLogger(__name__)
+
+np = LazyModule("numpy")
+sparse = LazyModule("scipy.sparse")
+
+# Seconds between rebuilds
+DEFAULT_REFRESH_INTERVAL = float(os.environ.get("FINIQ_SUGGESTIONS_REFRESH", "300"))
+SUGGESTIONS_PER_USER = 5
+
+
+def compute_suggestions(edges, completed_lessons, size=SUGGESTIONS_PER_USER):
+    """Top friend suggestions for every user
+
+    edges are (username, friend) pairs and completed_lessons maps usernames
+    to lesson names. Candidates are friends of friends who are not friends
+    yet, ranked by mutual friends, then by lessons in common. Returns
+    {username: [(candidate, mutual friends, shared lessons), ...]}.
+    """
+    users = sorted({name for edge in edges for name in edge} | set(completed_lessons))
+    if not edges:
+        return {}
+    position = {username: i for i, username in enumerate(users)}
+    n = len(users)
+
+    rows = [position[a] for a, b in edges] + [position[b] for a, b in edges]
+    cols = [position[b] for a, b in edges] + [position[a] for a, b in edges]
+    adjacency = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=(n, n))
+    adjacency.data[:] = 1  # an edge listed both ways still counts once
+
+    mutual = adjacency @ adjacency
+    mutual = mutual - sparse.diags(mutual.diagonal(), dtype=mutual.dtype)  # yourself
+    mutual = mutual - mutual.multiply(adjacency)  # already friends
+    mutual.eliminate_zeros()
+    mutual = mutual.tocoo()
+    if mutual.nnz == 0:
+        return {}
+
+    lessons = sorted({lesson for names in completed_lessons.values() for lesson in names})
+    lesson_position = {lesson: j for j, lesson in enumerate(lessons)}
+    lesson_rows, lesson_cols = [], []
+    for username, names in completed_lessons.items():
+        for lesson in names:
+            lesson_rows.append(position[username])
+            lesson_cols.append(lesson_position[lesson])
+    completed = sparse.csr_matrix(
+        (np.ones(len(lesson_rows), dtype=np.int32), (lesson_rows, lesson_cols)),
+        shape=(n, max(len(lessons), 1)))
+    # Lessons in common, only for the candidate pairs
+    shared = np.asarray(completed[mutual.row].multiply(completed[mutual.col]).sum(axis=1)).ravel()
+
+    # Mutual friends first, shared lessons break ties
+    score = mutual.data.astype(np.int64) * (len(lessons) + 1) + shared
+    order = np.lexsort((-score, mutual.row))
+    row = mutual.row[order]
+    # Keep the first `size` entries of each user's run of rows
+    run_start = np.flatnonzero(np.r_[True, row[1:] != row[:-1]])
+    place = np.arange(len(row)) - np.repeat(run_start, np.diff(np.r_[run_start, len(row)]))
+    keep = order[place < size]
+    suggestions: Dict[str, List[tuple]] = {}
+    for user, candidate, count, common in zip(
+            mutual.row[keep].tolist(), mutual.col[keep].tolist(),
+            mutual.data[keep].tolist(), shared[keep].tolist()):
+        suggestions.setdefault(users[user], []).append((users[candidate], count, common))
+    return suggestions
+
+
+class FriendSuggestions:
+    """Per-user suggestion lists, rebuilt in the background every interval seconds
+
+    load() returns (friend edges, {username: completed lessons}). The result
+    dict is swapped in whole, so readers never take a lock.
+    """
+
+    def __init__(self, load, interval=DEFAULT_REFRESH_INTERVAL, size=SUGGESTIONS_PER_USER):
+        self.load = load
+        self.interval = interval
+        self.size = size
+        self.suggestions: Dict[str, List[tuple]] = {}
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="finiq-friend-suggestions", daemon=True)
+        self._thread.start()
+
+    def refresh(self):
+        edges, completed_lessons = self.load()
+        self.suggestions = compute_suggestions(edges, completed_lessons, self.size)
+
+    def get(self, username) -> List[tuple]:
+        return self.suggestions.get(username, [])
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Failed to refresh friend suggestions")
+            if self._stopping.wait(self.interval):
+                return
+
+    def stop(self):
+        self._stopping.set()
@@ -0,0 +1,111 @@
+import datetime
+
+from journal import EventJournal, answer_event, friend_event, profile_event, read_journal, xp_event
+from storage import ProfileStore
+
+
+def make_profile(username, token):
+    return {"username": username, "token": token, "level": 1, "xp": 0, "coins": 100, "streak": 0,
+            "last_login": None, "correct_answers": 0, "total_questions": 0, "avatar": "🦖",
+            "account_type": "Home"}
+
+
+def test_replay_after_rename_keeps_the_renamed_profile(tmp_path):
+    db_path, journal_path = str(tmp_path / "t.db"), str(tmp_path / "t.events")
+    store = ProfileStore(db_path)
+    journal = EventJournal(journal_path, store.apply_events)
+    assert store.create_profile(make_profile("alice", "token-a"))
+    journal.append(profile_event(dict(make_profile("alice", "token-a"), xp=40)))
+    journal.append(answer_event("token-a", "alice", 3, 2, 40, 120, 1, {}))
+    assert journal.sync(checkpoint=True)
+    assert read_journal(journal_path) == []
+    assert store.rename_profile("alice", "alice2")
+    journal.close()
+
+    # Restart: replaying the journal must neither fail nor bring "alice" back
+    journal = EventJournal(journal_path, store.apply_events)
+    journal.close()
+    assert store.load_profile("alice") is None
+    assert store.load_profile("alice2")["xp"] == 40
+    assert store.create_profile(make_profile("alice", "token-b"))
+    assert store.load_profile("alice")["xp"] == 0
+    store.close()
+
+
+def test_small_journal_is_kept_without_checkpoint(tmp_path):
+    journal_path = str(tmp_path / "t.events")
+    applied = []
+    journal = EventJournal(journal_path, applied.extend)
+    journal.append(answer_event("token-b", "bob", 1, 1, 20, 110, 1, {}))
+    assert journal.sync()
+    journal.close()
+    assert [event["u"] for event in applied] == ["bob"]
+    assert [event["u"] for event in read_journal(journal_path)] == ["bob"]
+
+
+def test_events_queued_before_a_rename_follow_the_token(tmp_path):
+    store = ProfileStore(str(tmp_path / "t.db"))
+    assert store.create_profile(make_profile("alice", "token-a"))
+    assert store.rename_profile("alice", "alice2")
+    assert store.create_profile(make_profile("alice", "token-b"))
+    # A tab that has not seen the rename still sends the old name
+    assert store.apply_events([
+        answer_event("token-a", "alice", 3, 2, 40, 120, 1, {}),
+        profile_event(dict(make_profile("alice", "token-a"), xp=60)),
+    ]) == []
+    assert store.load_profile("alice2")["xp"] == 60
+    assert store.load_profile("alice")["token"] == "token-b"
+    assert store.load_profile("alice")["xp"] == 0
+    store.close()
+
+
+def test_rejected_event_is_set_aside_without_blocking_the_rest(tmp_path):
+    db_path, journal_path = str(tmp_path / "t.db"), str(tmp_path / "t.events")
+    store = ProfileStore(db_path)
+    assert store.create_profile(make_profile("alice", "token-a"))
+    journal = EventJournal(journal_path, store.apply_events)
+    journal.append(profile_event(dict(make_profile("alice", "token-a"), avatar=None)))  # NOT NULL
+    journal.append(answer_event("token-a", "alice", 3, 2, 40, 120, 1, {}))
+    assert journal.sync(checkpoint=True)
+    journal.close()
+    assert store.load_profile("alice")["xp"] == 40
+    assert [event["t"] for event in read_journal(journal_path + ".rejected")] == ["p"]
+    assert read_journal(journal_path) == []
+    store.close()
+
+
+def test_sync_reports_a_skipped_checkpoint(tmp_path):
+    journal_path = str(tmp_path / "t.events")
+    applied, failing = [], [True]
+
+    def apply_batch(events):
+        if failing[0]:
+            raise OSError("store unavailable")
+        applied.extend(events)
+
+    journal = EventJournal(journal_path, apply_batch)
+    journal.append(answer_event("token-b", "bob", 1, 1, 20, 110, 1, {}))
+    assert not journal.sync(checkpoint=True)
+    assert [event["u"] for event in read_journal(journal_path)] == ["bob"]
+    # Once the store is back, the held-back events go in with the next batch
+    failing[0] = False
+    assert journal.sync(checkpoint=True)
+    journal.close()
+    assert [event["u"] for event in applied] == ["bob"]
+    assert read_journal(journal_path) == []
+
+
+def test_xp_and_friend_events_from_before_a_rename_follow_the_token(tmp_path):
+    store = ProfileStore(str(tmp_path / "t.db"))
+    assert store.create_profile(make_profile("alice", "token-a"))
+    assert store.create_profile(make_profile("bob", "token-b"))
+    assert store.rename_profile("alice", "alice2")
+    assert store.create_profile(make_profile("alice", "token-c"))
+    day = datetime.date(2026, 10, 18)
+    assert store.apply_events([
+        xp_event("token-a", "alice", day, 40),
+        friend_event("token-a", "alice", "request", "bob"),
+    ]) == []
+    assert [(row["username"], row["xp"]) for row in store.xp_bucket_rows(day)] == [("alice2", 40)]
+    assert store.friend_graph_rows() == ([], [("alice2", "bob")])
+    store.close()
@@ -0,0 +1,72 @@
+import bisect
+import random
+
+import pytest
+
+from leaderboard import IndexableSkiplist, Leaderboard
+
+
+def check_against(skiplist, expected):
+    assert len(skiplist) == len(expected)
+    assert skiplist.slice(0, len(expected)) == expected
+    for position, key in enumerate(expected):
+        assert skiplist[position] == key
+        assert skiplist.rank(key) == position
+    for _ in range(20):
+        start, stop = sorted(random.randrange(-2, len(expected) + 3) for _ in range(2))
+        assert skiplist.slice(start, stop) == expected[max(start, 0):max(stop, 0)]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_skiplist_matches_a_sorted_list(seed):
+    random.seed(seed)
+    skiplist, expected = IndexableSkiplist(), []
+    for step in range(2000):
+        if expected and random.random() < 0.4:
+            key = random.choice(expected)
+            skiplist.remove(key)
+            expected.remove(key)
+        else:
+            key = random.randrange(10000)
+            if key in expected:
+                continue
+            skiplist.insert(key)
+            bisect.insort(expected, key)
+        if step % 250 == 0:
+            check_against(skiplist, expected)
+    check_against(skiplist, expected)
+    with pytest.raises(IndexError):
+        skiplist[len(expected)]
+    with pytest.raises(KeyError):
+        skiplist.rank(-1)
+
+
+@pytest.mark.parametrize("size", [0, 1, 2, 1000])
+def test_skiplist_built_from_sorted_keys_stays_consistent(size):
+    random.seed(size)
+    expected = sorted(random.sample(range(100000), size))
+    skiplist = IndexableSkiplist.from_sorted(expected)
+    check_against(skiplist, expected)
+    for _ in range(300):
+        key = random.randrange(100000)
+        if key in expected:
+            skiplist.remove(key)
+            expected.remove(key)
+        else:
+            skiplist.insert(key)
+            bisect.insort(expected, key)
+    check_against(skiplist, expected)
+
+
+def test_bulk_seeded_leaderboard_matches_incremental_updates():
+    random.seed(7)
+    rows = [{"username": f"user{i % 300}", "xp": random.randrange(0, 5000, 10), "level": 1, "streak": 0}
+            for i in range(400)]
+    seeded = Leaderboard(rows)
+    incremental = Leaderboard()
+    for row in rows:
+        incremental.update(row['username'], row['xp'], row['level'], row['streak'])
+    assert seeded.rows() == incremental.rows()
+    assert seeded.sketch.to_dict() == incremental.sketch.to_dict()
+    seeded.update("user1", 99999, 9, 3)
+    assert seeded.rank("user1") == 1
@@ -0,0 +1,30 @@
+import gc
+
+from sessions import OpenProfiles, UserData
+
+
+def test_sessions_on_one_profile_share_its_user_data():
+    profiles = OpenProfiles()
+    loads = []
+
+    def load():
+        loads.append(1)
+        return UserData(xp=0)
+
+    first = profiles.open("token-a", load)
+    second = profiles.open("token-a", load)
+    assert first is second and len(loads) == 1
+    first["xp"] = 20
+    assert second["xp"] == 20
+    assert profiles.open("missing", lambda: None) is None
+
+
+def test_profile_is_dropped_with_its_last_session():
+    profiles = OpenProfiles()
+    user_data = UserData(xp=0)
+    profiles.add("token-a", user_data)
+    assert profiles.open("token-a", lambda: None) is user_data
+    del user_data
+    gc.collect()
+    assert len(profiles) == 0
+    assert profiles.open("token-a", lambda: None) is None
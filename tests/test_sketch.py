@@ -0,0 +1,70 @@
+import math
+import random
+
+import pytest
+
+from sketch import XPSketch
+
+
+def random_xp(count):
+    return [0 if random.random() < 0.1 else int(random.lognormvariate(6, 1.5)) for _ in range(count)]
+
+
+def sketch_of(values):
+    sketch = XPSketch()
+    for value in values:
+        sketch.add(value)
+    return sketch
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_quantiles_stay_within_relative_accuracy(seed):
+    random.seed(seed)
+    values = random_xp(5000)
+    sketch = sketch_of(values)
+    ordered = sorted(values)
+    for q in [0, 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 1]:
+        exact = ordered[math.floor(q * (len(ordered) - 1))]
+        assert sketch.quantile(q) == pytest.approx(exact, rel=sketch.relative_accuracy, abs=1e-9)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_top_percent_brackets_the_exact_share(seed):
+    random.seed(seed)
+    values = random_xp(3000)
+    sketch = sketch_of(values)
+    for value in random.sample(values, 50) + [1, 10 ** 9]:
+        if value <= 0:
+            continue
+        at_least = sketch.top_percent(value) * len(values) / 100
+        # Values in the same bucket count as "at least", so the share can only grow by one bucket
+        assert max(sum(v >= value for v in values), 1) <= round(at_least)
+        assert round(at_least) <= max(sum(v >= value / sketch.gamma for v in values), 1)
+    assert sketch.top_percent(0) == 100.0
+
+
+def test_merge_matches_one_sketch_of_everything():
+    random.seed(1)
+    first, second = random_xp(1000), random_xp(700)
+    merged = sketch_of(first)
+    merged.merge(sketch_of(second))
+    assert merged.to_dict() == sketch_of(first + second).to_dict()
+    assert merged.count == len(first) + len(second)
+    with pytest.raises(ValueError):
+        merged.merge(XPSketch(relative_accuracy=0.05))
+
+
+def test_round_trip_and_remove():
+    random.seed(2)
+    values = random_xp(500)
+    sketch = sketch_of(values)
+    restored = XPSketch.from_dict(sketch.to_dict())
+    assert restored.to_dict() == sketch.to_dict()
+    assert restored.count == sketch.count
+    assert restored.quantile(0.5) == sketch.quantile(0.5)
+    for value in values[250:]:
+        restored.remove(value)
+    assert restored.to_dict() == sketch_of(values[:250]).to_dict()
+    copy = sketch.copy()
+    copy.add(12345)
+    assert copy.count == sketch.count + 1
@@ -0,0 +1,31 @@
+import sqlite3
+
+from storage import ProfileStore
+
+
+def test_legacy_friend_lists_are_migrated_once(tmp_path):
+    db_path = str(tmp_path / "t.db")
+    ProfileStore(db_path).close()
+    conn = sqlite3.connect(db_path)
+    for column in ("friends", "friend_requests_sent", "friend_requests_received"):
+        conn.execute(f"ALTER TABLE profiles ADD COLUMN {column} TEXT NOT NULL DEFAULT '[]'")
+    conn.execute("INSERT INTO profiles (username, token, friends, friend_requests_sent) "
+                 "VALUES ('alice', 'a', '[\"bob\"]', '[\"carol\"]')")
+    conn.execute("INSERT INTO profiles (username, token, friends) VALUES ('bob', 'b', '[\"alice\"]')")
+    conn.execute("INSERT INTO profiles (username, token) VALUES ('dave', 'd')")
+    conn.commit()
+
+    store = ProfileStore(db_path)
+    friendships, requests = store.friend_graph_rows()
+    store.close()
+    assert sorted(friendships) == [("alice", "bob"), ("bob", "alice")]
+    assert requests == [("alice", "carol")]
+
+    # A later start has nothing left to migrate and rewrites no rows
+    conn.execute("CREATE TABLE updates (username TEXT)")
+    conn.execute("CREATE TRIGGER log_updates AFTER UPDATE ON profiles "
+                 "BEGIN INSERT INTO updates VALUES (new.username); END")
+    conn.commit()
+    ProfileStore(db_path).close()
+    assert conn.execute("SELECT COUNT(*) FROM updates").fetchone()[0] == 0
+    conn.close()
@@ -0,0 +1,87 @@
+import datetime
+import random
+
+import pytest
+
+from streaks import ActivityCalendar
+
+START = datetime.date(2023, 11, 1)
+SPAN_DAYS = 800  # crosses two year boundaries and the 2024 leap day
+
+
+def brute_current(covered, today):
+    day = today if today in covered else today - datetime.timedelta(days=1)
+    streak = 0
+    while day in covered:
+        streak += 1
+        day -= datetime.timedelta(days=1)
+    return streak
+
+
+def brute_longest(covered):
+    longest = 0
+    for day in covered:
+        if day - datetime.timedelta(days=1) not in covered:
+            length = 1
+            while day + datetime.timedelta(days=length) in covered:
+                length += 1
+            longest = max(longest, length)
+    return longest
+
+
+def random_days(density):
+    return {START + datetime.timedelta(days=offset) for offset in range(SPAN_DAYS) if random.random() < density}
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_streaks_match_a_walk_over_dates(seed):
+    random.seed(seed)
+    active = random_days(random.choice([0.3, 0.7, 0.95]))
+    calendar = ActivityCalendar()
+    for day in active:
+        assert calendar.mark_active(day)
+        assert not calendar.mark_active(day)
+    assert calendar.longest_streak() == brute_longest(active)
+    assert calendar.last_covered_day() == (max(active) if active else None)
+    for offset in range(-5, SPAN_DAYS + 5, 7):
+        today = START + datetime.timedelta(days=offset)
+        # Later days must not count towards a streak as of today
+        assert calendar.current_streak(today) == brute_current({day for day in active if day <= today}, today)
+    restored = ActivityCalendar.from_dict(calendar.to_dict())
+    assert restored.to_dict() == calendar.to_dict()
+    assert restored.longest_streak() == calendar.longest_streak()
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_protect_gap_fills_only_gaps_the_tokens_cover(seed):
+    random.seed(seed)
+    active = random_days(0.8)
+    calendar = ActivityCalendar()
+    for day in active:
+        calendar.mark_active(day)
+    covered = set(active)
+    last = max(active)
+    for _ in range(20):
+        today = last + datetime.timedelta(days=random.randint(1, 6))
+        tokens = random.randint(0, 4)
+        missed = (today - last).days - 1
+        used = calendar.protect_gap(today, tokens)
+        expected = missed if 0 < missed <= tokens else 0
+        assert used == expected
+        protected = {last + datetime.timedelta(days=offset) for offset in range(1, used + 1)}
+        assert not any(calendar.is_active(day) for day in protected)  # covered, but not activity
+        covered |= protected
+        calendar.mark_active(today)
+        covered.add(today)
+        assert calendar.current_streak(today) == brute_current(covered, today)
+        assert calendar.longest_streak() == brute_longest(covered)
+        last = today
+
+
+def test_seeded_calendar_rebuilds_the_saved_streak():
+    calendar = ActivityCalendar.seeded(datetime.date(2025, 1, 3), 10)
+    assert calendar.current_streak(datetime.date(2025, 1, 3)) == 10
+    assert calendar.current_streak(datetime.date(2025, 1, 4)) == 10
+    assert calendar.current_streak(datetime.date(2025, 1, 5)) == 0
+    assert calendar.longest_streak() == 10
+    assert not ActivityCalendar.seeded(datetime.date(2025, 1, 3), 0)
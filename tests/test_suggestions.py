@@ -0,0 +1,57 @@
+import random
+
+import pytest
+
+from suggestions import compute_suggestions
+
+LESSONS = [f"lesson{i}" for i in range(8)]
+
+
+def brute_candidates(edges, completed_lessons):
+    """{user: {candidate: (mutual, shared)}} by walking friends of friends"""
+    friends = {}
+    for a, b in edges:
+        friends.setdefault(a, set()).add(b)
+        friends.setdefault(b, set()).add(a)
+    candidates = {}
+    for user, direct in friends.items():
+        for friend in direct:
+            for candidate in friends[friend]:
+                if candidate != user and candidate not in direct:
+                    shared = set(completed_lessons.get(user, ())) & set(completed_lessons.get(candidate, ()))
+                    candidates.setdefault(user, {})[candidate] = (len(direct & friends[candidate]), len(shared))
+    return candidates
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_suggestions_match_a_graph_walk(seed):
+    random.seed(seed)
+    users = [f"user{i}" for i in range(60)]
+    edges = set()
+    while len(edges) < 150:
+        a, b = random.sample(users, 2)
+        if (b, a) not in edges:
+            edges.add((a, b))
+    edges = sorted(edges) + [sorted(edges)[0][::-1]]  # a friendship listed both ways counts once
+    completed_lessons = {user: random.sample(LESSONS, random.randint(0, 5)) for user in users}
+    size = 5
+
+    suggestions = compute_suggestions(edges, completed_lessons, size)
+    expected = brute_candidates(edges, completed_lessons)
+    assert set(suggestions) == set(expected)
+    for user, picks in suggestions.items():
+        scores = expected[user]
+        assert len(picks) == min(size, len(scores))
+        assert len({candidate for candidate, _, _ in picks}) == len(picks)
+        for candidate, mutual, shared in picks:
+            assert scores[candidate] == (mutual, shared)
+        ranked = [(mutual, shared) for _, mutual, shared in picks]
+        assert ranked == sorted(ranked, reverse=True)
+        # Nobody left out scores better than the last one kept
+        assert max((score for candidate, score in scores.items()
+                    if candidate not in {pick[0] for pick in picks}), default=(0, 0)) <= ranked[-1]
+
+
+def test_no_friends_means_no_suggestions():
+    assert compute_suggestions([], {"alice": ["lesson1"]}) == {}
+    assert compute_suggestions([("alice", "bob")], {}) == {}
@@ -0,0 +1,77 @@
+"""In-memory username index for the Finasaur app.
+
+Usernames are unique ignoring case: "Alice" and "alice" are the same user.
+The index keeps the case-folded names in one sorted list, so an existence
+check is a dict lookup and a prefix search is a bisect plus a walk over just
+the matches, which stays well under a millisecond with millions of names.
+"""
+import bisect
+import threading
+from typing import Dict, List, Optional
+
+
+def fold(username):
+    return username.casefold()
+
+
+class UsernameIndex:
+    """Sorted, case-folded usernames with prefix search"""
+
+    def __init__(self, usernames=()):
+        self._lock = threading.Lock()
+        self._names: Dict[str, str] = {}  # folded -> username as the user typed it
+        for username in usernames:
+            self._names.setdefault(fold(username), username)
+        self._sorted: List[str] = sorted(self._names)
+
+    def __len__(self):
+        return len(self._sorted)
+
+    def lookup(self, username) -> Optional[str]:
+        """The registered spelling of username, or None if nobody has it"""
+        return self._names.get(fold(username))
+
+    def exists(self, username) -> bool:
+        return fold(username) in self._names
+
+    def add(self, username) -> bool:
+        """Register username; returns False if it is taken in any letter case"""
+        key = fold(username)
+        with self._lock:
+            if key in self._names:
+                return False
+            self._names[key] = username
+            bisect.insort(self._sorted, key)
+            return True
+
+    def remove(self, username):
+        key = fold(username)
+        with self._lock:
+            if self._names.pop(key, None) is not None:
+                del self._sorted[bisect.bisect_left(self._sorted, key)]
+
+    def rename(self, old_username, new_username) -> bool:
+        """Swap one name for another; returns False if the new one is taken by someone else"""
+        old_key, new_key = fold(old_username), fold(new_username)
+        with self._lock:
+            if new_key in self._names and new_key != old_key:
+                return False
+            if self._names.pop(old_key, None) is not None:
+                del self._sorted[bisect.bisect_left(self._sorted, old_key)]
+            self._names[new_key] = new_username
+            bisect.insort(self._sorted, new_key)
+            return True
+
+    def complete(self, prefix, limit=8) -> List[str]:
+        """Up to limit usernames starting with prefix (ignoring case), alphabetically"""
+        key = fold(prefix)
+        if not key:
+            return []
+        with self._lock:
+            start = bisect.bisect_left(self._sorted, key)
+            matches = []
+            for folded in self._sorted[start:start + limit]:
+                if not folded.startswith(key):
+                    break
+                matches.append(self._names[folded])
+            return matches